@@ -22,9 +22,9 @@ interface BacktestPanelProps {
 export function BacktestPanel({ backtest, isLoading, onRunBacktest }: BacktestPanelProps) {
     // 多曲线对比图表
     const multiLineChartOption = useMemo(() => {
-        if (!backtest?.nav) return null
-        const dates = Object.keys(backtest.nav).map(d => d.slice(0, 10))
-        const strategyNav = Object.values(backtest.nav) as number[]
+        if (!backtest?.nav_values) return null
+        const dates = backtest.nav_dates
+        const strategyNav = backtest.nav_values
         const strategyNormed = strategyNav.map(v => (v / strategyNav[0] * 100))
 
         const series: any[] = [{
@@ -42,13 +42,11 @@ export function BacktestPanel({ backtest, isLoading, onRunBacktest }: BacktestPa
 
         if (backtest.benchmarks) {
             for (const [key, bench] of Object.entries(backtest.benchmarks)) {
-                const benchNav = bench.nav
-                if (benchNav) {
-                    const vals = dates.map(d => benchNav[d] || null)
+                if (bench.values) {
                     series.push({
                         name: bench.name,
                         type: 'line',
-                        data: vals,
+                        data: bench.values,
                         smooth: true,
                         lineStyle: { width: 2, color: colors[colorIdx % colors.length] },
                         itemStyle: { color: colors[colorIdx % colors.length] }
@@ -17,10 +17,13 @@ export interface BacktestResult {
     annual_return: number
     max_drawdown: number
     sharpe: number
-    nav: Record<string, number>
+    nav_dates: string[]
+    nav_values: number[]
+    monthly_dates: string[]
+    monthly_returns: number[]
     benchmarks?: Record<string, {
         name: string
-        nav: Record<string, number>
+        values: (number | null)[]
     }>
 }
 
@@ -20,12 +20,19 @@ DATA_DIR = Path(__file__).parent.parent / "data"
 DB_PATH = DATA_DIR / "users.db"
 
 
+# 与 src/auth.py 保持一致：scrypt$n$r$p$salt$hash
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+
+
 def hash_password(password: str, salt: str = None) -> str:
-    """密码哈希（SHA256 + 随机盐）"""
+    """密码哈希（scrypt + 随机盐）"""
     if salt is None:
         salt = secrets.token_hex(16)
-    hashed = hashlib.sha256((password + salt).encode()).hexdigest()
-    return f"{salt}${hashed}"
+    hashed = hashlib.scrypt(
+        password.encode(), salt=bytes.fromhex(salt),
+        n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32,
+    ).hex()
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt}${hashed}"
 
 
 def init_admin(username: str, password: str):
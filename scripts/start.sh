@@ -26,8 +26,10 @@ sleep 1
 
 echo "Starting Backend..."
 cd src
-# 使用 4 个 workers 提高并发，设置超时避免请求挂起
-PYTHONUNBUFFERED=1 python -m uvicorn main:app --host 0.0.0.0 --port 8000 --workers 4 --timeout-keep-alive 30 &
+# 使用 4 个 workers 提高并发，设置超时避免请求挂起；uvloop + httptools 由 uvicorn[standard] 提供
+# 每个 worker 最多同时处理 500 个连接，超出时直接返回 503 而不是排队到超时；监听队列放宽到 2048
+PYTHONUNBUFFERED=1 python -m uvicorn main:app --host 0.0.0.0 --port 8000 --workers 4 --timeout-keep-alive 30 \
+    --loop uvloop --http httptools --limit-concurrency 500 --backlog 2048 &
 BACKEND_PID=$!
 cd ..
 
@@ -5,7 +5,12 @@
 import os
 import sqlite3
 import hashlib
+import hmac
 import secrets
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Optional
@@ -20,102 +25,267 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
 
+# scrypt 参数：n=2^14, r=8 约占 16MB 内存，单次哈希数十毫秒
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2 ** 14, 8, 1
+
+
+def _scrypt_hex(password: str, salt: str, n: int, r: int, p: int) -> str:
+    return hashlib.scrypt(password.encode(), salt=bytes.fromhex(salt), n=n, r=r, p=p, dklen=32).hex()
+
+
 def hash_password(password: str, salt: str = None) -> str:
-    """密码哈希（SHA256 + 随机盐）"""
+    """密码哈希（scrypt + 随机盐），格式 scrypt$n$r$p$salt$hash"""
     if salt is None:
         salt = secrets.token_hex(16)
-    hashed = hashlib.sha256((password + salt).encode()).hexdigest()
-    return f"{salt}${hashed}"
+    hashed = _scrypt_hex(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt}${hashed}"
+
+
+@lru_cache(maxsize=1)
+def _dummy_password_hash() -> str:
+    """随机密码的占位哈希，参数与真实哈希相同"""
+    return hash_password(secrets.token_hex(16))
 
 
 def verify_password(plain_password: str, stored_password: str) -> bool:
-    """验证密码（仅支持 salt$hash 格式）"""
+    """验证密码（scrypt 格式，兼容旧的 salt$sha256 格式）"""
     if '$' not in stored_password:
-        return False  # 不再兼容旧格式
-    salt, _ = stored_password.split('$', 1)
-    return hash_password(plain_password, salt) == stored_password
+        return False  # 不再兼容无盐格式
+    if stored_password.startswith("scrypt$"):
+        try:
+            _, n, r, p, salt, expected = stored_password.split('$')
+            hashed = _scrypt_hex(plain_password, salt, int(n), int(r), int(p))
+        except ValueError:
+            return False
+    else:
+        salt, expected = stored_password.split('$', 1)
+        hashed = hashlib.sha256((plain_password + salt).encode()).hexdigest()
+    # compare_digest 为常数时间比较
+    return hmac.compare_digest(hashed, expected)
 
 
-def init_db():
-    """初始化数据库"""
-    DATA_DIR.mkdir(exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            is_admin INTEGER DEFAULT 0,
-            avatar TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # 创建留言表（支持回复、点赞/踩）
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            parent_id INTEGER DEFAULT NULL,
-            content TEXT NOT NULL,
-            likes INTEGER DEFAULT 0,
-            dislikes INTEGER DEFAULT 0,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id),
-            FOREIGN KEY(parent_id) REFERENCES messages(id)
-        )
-    ''')
+# 密码校验结果缓存：键为 HMAC(SECRET_KEY, 存储哈希 + 明文)，不保存明文；存储哈希变化后自然失效
+_VERIFY_CACHE_TTL = 60  # 秒
+_VERIFY_CACHE_SIZE = 128
+_verify_cache: OrderedDict = OrderedDict()
+_verify_cache_lock = threading.Lock()
+
+
+def verify_password_cached(plain_password: str, stored_password: str) -> bool:
+    """带短时缓存的密码校验，同一密码短时间内重复尝试不再重复计算哈希"""
+    token = hmac.new(SECRET_KEY.encode(), f"{stored_password}\0{plain_password}".encode(), "sha256").digest()
+    now = time.monotonic()
+    with _verify_cache_lock:
+        hit = _verify_cache.get(token)
+        if hit is not None and now - hit[1] < _VERIFY_CACHE_TTL:
+            _verify_cache.move_to_end(token)
+            return hit[0]
     
-    # 创建留言反应表（防止重复点赞/踩）
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS message_reactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            message_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            reaction_type TEXT NOT NULL,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(message_id, user_id),
-            FOREIGN KEY(message_id) REFERENCES messages(id),
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-    ''')
-    conn.commit()
+    ok = verify_password(plain_password, stored_password)
+    with _verify_cache_lock:
+        _verify_cache[token] = (ok, now)
+        _verify_cache.move_to_end(token)
+        while len(_verify_cache) > _VERIFY_CACHE_SIZE:
+            _verify_cache.popitem(last=False)
+    return ok
+
+
+# 每个线程复用一条连接（FastAPI 同步接口在线程池中执行），省去每次调用的打开/关闭开销
+_local = threading.local()
+
+
+def get_conn() -> sqlite3.Connection:
+    """当前线程的数据库连接，首次使用时创建并设置 WAL 等参数"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        DATA_DIR.mkdir(exist_ok=True)
+        conn = sqlite3.connect(DB_PATH)
+        # Row 同时支持下标与列名访问，各路由共用同一连接
+        conn.row_factory = sqlite3.Row
+        # WAL 下读写互不阻塞；NORMAL 同步在 WAL 模式下仍保证一致性
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-64000")
+        # 读走内存映射，省去 read 系统调用与页拷贝
+        conn.execute("PRAGMA mmap_size=268435456")
+        _local.conn = conn
+    return conn
+
+
+def maintain_db():
+    """定期维护：按需刷新查询规划器的统计信息，再把 WAL 合并回主库并截断，防止其持续增长"""
+    conn = get_conn()
+    # optimize 只对统计信息过期的表执行 ANALYZE，留言/反应表增长后规划器仍能选中复合索引
+    conn.execute("PRAGMA optimize")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+# 数据库结构版本（PRAGMA user_version）；结构变化时加一并在 init_db 中补充迁移
+# 4: 升级时执行一次 ANALYZE，已是 3 的旧库也为留言索引生成统计信息
+SCHEMA_VERSION = 4
+
+# 旧库升级需补齐的字段：(表, 字段, 定义)
+_COLUMN_MIGRATIONS = [
+    ("messages", "parent_id", "INTEGER DEFAULT NULL"),
+    ("messages", "likes", "INTEGER DEFAULT 0"),
+    ("messages", "dislikes", "INTEGER DEFAULT 0"),
+    ("users", "avatar", "TEXT"),
+]
+
+
+def init_db():
+    """初始化数据库；结构已是最新版本时只读一次 user_version，不做任何写操作"""
+    conn = get_conn()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
     
-    # 升级旧表结构
-    try:
-        c.execute("ALTER TABLE messages ADD COLUMN parent_id INTEGER DEFAULT NULL")
-        conn.commit()
-    except:
-        pass
-    try:
-        c.execute("ALTER TABLE messages ADD COLUMN likes INTEGER DEFAULT 0")
-        conn.commit()
-    except:
-        pass
-    try:
-        c.execute("ALTER TABLE messages ADD COLUMN dislikes INTEGER DEFAULT 0")
-        conn.commit()
-    except:
-        pass
+    with conn:
+        c = conn.cursor()
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password_hash TEXT NOT NULL,
+                is_admin INTEGER DEFAULT 0,
+                avatar TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
     
-    # 确保新字段存在（升级旧数据库）
-    try:
-        c.execute("ALTER TABLE users ADD COLUMN avatar TEXT")
-        conn.commit()
-    except:
-        pass  # 字段已存在
+        # 创建留言表（支持回复、点赞/踩）
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                parent_id INTEGER DEFAULT NULL,
+                content TEXT NOT NULL,
+                likes INTEGER DEFAULT 0,
+                dislikes INTEGER DEFAULT 0,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY(user_id) REFERENCES users(id),
+                FOREIGN KEY(parent_id) REFERENCES messages(id)
+            )
+        ''')
     
-    conn.close()
+        # 创建留言反应表（防止重复点赞/踩）
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS message_reactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                message_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                reaction_type TEXT NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(message_id, user_id),
+                FOREIGN KEY(message_id) REFERENCES messages(id),
+                FOREIGN KEY(user_id) REFERENCES users(id)
+            )
+        ''')
+        
+        # 模拟交易账户（原 data/accounts 下的每用户 JSON 文件，首次访问时由 trading 模块导入）
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS accounts (
+                user_id INTEGER PRIMARY KEY,
+                cash REAL NOT NULL,
+                initial_capital REAL NOT NULL,
+                created_at TEXT,
+                last_updated TEXT
+            )
+        ''')
+        # 持仓按 rowid 保持建仓顺序
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS positions (
+                user_id INTEGER NOT NULL,
+                symbol TEXT NOT NULL,
+                shares INTEGER NOT NULL,
+                avg_cost REAL NOT NULL,
+                UNIQUE(user_id, symbol)
+            )
+        ''')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS nav_history (
+                user_id INTEGER NOT NULL,
+                date TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY(user_id, date)
+            ) WITHOUT ROWID
+        ''')
+        # 交易记录整条以 JSON 保存（含费用明细），按 id 递增即时间顺序
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                time TEXT NOT NULL,
+                data TEXT NOT NULL
+            )
+        ''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions(user_id, id)")
+        
+        # 升级旧表结构：按 table_info 判断缺失字段，不再依赖 ALTER 失败
+        for table, column, ddl in _COLUMN_MIGRATIONS:
+            existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+        
+        # 留言按 parent_id 取顶级留言/回复并按时间排序，(parent_id, created_at) 索引同时覆盖过滤和排序；
+        # message_reactions 的 UNIQUE(message_id, user_id) 已自带索引，无需另建
+        c.execute("CREATE INDEX IF NOT EXISTS idx_messages_parent_created ON messages(parent_id, created_at)")
+        # 点赞/踩计数由触发器随 message_reactions 的增删改同步维护
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_reaction_insert AFTER INSERT ON message_reactions
+            BEGIN
+                UPDATE messages
+                SET likes = likes + (NEW.reaction_type = 'like'),
+                    dislikes = dislikes + (NEW.reaction_type = 'dislike')
+                WHERE id = NEW.message_id;
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_reaction_delete AFTER DELETE ON message_reactions
+            BEGIN
+                UPDATE messages
+                SET likes = likes - (OLD.reaction_type = 'like'),
+                    dislikes = dislikes - (OLD.reaction_type = 'dislike')
+                WHERE id = OLD.message_id;
+            END
+        ''')
+        c.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_reaction_update AFTER UPDATE OF reaction_type ON message_reactions
+            BEGIN
+                UPDATE messages
+                SET likes = likes - (OLD.reaction_type = 'like') + (NEW.reaction_type = 'like'),
+                    dislikes = dislikes - (OLD.reaction_type = 'dislike') + (NEW.reaction_type = 'dislike')
+                WHERE id = NEW.message_id;
+            END
+        ''')
+        # 启用触发器前的计数按反应表重算一次，保证与之后的增量维护一致
+        c.execute('''
+            UPDATE messages SET
+                likes = (SELECT COUNT(*) FROM message_reactions r
+                         WHERE r.message_id = messages.id AND r.reaction_type = 'like'),
+                dislikes = (SELECT COUNT(*) FROM message_reactions r
+                            WHERE r.message_id = messages.id AND r.reaction_type = 'dislike')
+        ''')
+        
+        # 为已有数据的旧库生成统计信息，规划器据此选用上面的索引
+        c.execute("ANALYZE")
+        c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+# 常用 SQL 模板：文本固定，sqlite3 按 SQL 文本命中每个连接的语句缓存，免去重复编译
+SQL_GET_USER = "SELECT id, username, password_hash, is_admin, avatar FROM users WHERE username = ?"
+SQL_USER_EXISTS = "SELECT 1 FROM users WHERE username = ?"
+SQL_INSERT_USER = "INSERT INTO users (username, password_hash) VALUES (?, ?)"
+SQL_UPDATE_PASSWORD = "UPDATE users SET password_hash = ? WHERE id = ?"
+SQL_ALL_USERS = "SELECT id, username, is_admin, created_at FROM users"
+SQL_USER_BY_ID = "SELECT username, is_admin FROM users WHERE id = ?"
+SQL_DELETE_USER = "DELETE FROM users WHERE id = ?"
 
 
 def get_user(username: str) -> Optional[dict]:
     """获取用户"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, username, password_hash, is_admin, avatar FROM users WHERE username = ?", (username,))
-    row = c.fetchone()
-    conn.close()
+    row = get_conn().execute(SQL_GET_USER, (username,)).fetchone()
     
     if row:
         return {
@@ -130,7 +300,6 @@ def get_user(username: str) -> Optional[dict]:
 
 def _generate_default_avatar(username: str) -> str:
     """生成默认头像 URL（使用 DiceBear API）"""
-    import hashlib
     seed = hashlib.md5(username.encode()).hexdigest()
     return f"https://api.dicebear.com/7.x/avataaars/svg?seed={seed}"
 
@@ -142,32 +311,46 @@ def create_user(username: str, password: str) -> tuple[bool, str]:
     if len(password) < 6:
         return False, "密码至少6个字符"
     
-    if get_user(username):
+    conn = get_conn()
+    # 只查存在性，不取整行；放在哈希之前，重名时不做无用的 scrypt 计算
+    if conn.execute(SQL_USER_EXISTS, (username,)).fetchone():
         return False, "用户名已存在"
     
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
     try:
         password_hash = hash_password(password)
-        c.execute(
-            "INSERT INTO users (username, password_hash) VALUES (?, ?)",
-            (username, password_hash)
-        )
-        conn.commit()
+        with conn:
+            conn.execute(SQL_INSERT_USER, (username, password_hash))
         return True, "注册成功"
     except Exception as e:
         return False, str(e)
-    finally:
-        conn.close()
+
+
+def needs_rehash(stored_password: str) -> bool:
+    """存储的哈希是否为旧格式或旧参数，需要在下次登录时升级"""
+    return not stored_password.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+def update_password(user_id: int, new_password: str):
+    """更新用户密码（按当前算法重新哈希）"""
+    conn = get_conn()
+    with conn:
+        conn.execute(SQL_UPDATE_PASSWORD, (hash_password(new_password), user_id))
 
 
 def authenticate_user(username: str, password: str) -> tuple[Optional[dict], str]:
     """认证用户，返回 (用户信息, 错误信息)"""
     user = get_user(username)
-    if not user:
-        return None, "用户名不存在"
-    if not verify_password(password, user["password_hash"]):
-        return None, "密码错误"
+    # 用户不存在时也对占位哈希做一次校验，两种失败耗时一致、提示相同，无法借此枚举用户名
+    stored = user["password_hash"] if user else _dummy_password_hash()
+    ok = verify_password_cached(password, stored)
+    if not stored.startswith("scrypt$"):
+        # 旧的 salt$sha256 哈希校验只需微秒，补做一次占位 scrypt 校验，耗时与其他情况一致
+        verify_password_cached(password, _dummy_password_hash())
+    if not (user and ok):
+        return None, "用户名或密码错误"
+    # 旧的 salt$sha256 哈希在登录成功时顺带升级为 scrypt，此时明文已知
+    if needs_rehash(user["password_hash"]):
+        update_password(user["id"], password)
     return user, ""
 
 
@@ -190,11 +373,7 @@ def decode_token(token: str) -> Optional[dict]:
 
 def get_all_users() -> list:
     """获取所有用户（管理员用）"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, username, is_admin, created_at FROM users")
-    rows = c.fetchall()
-    conn.close()
+    rows = get_conn().execute(SQL_ALL_USERS).fetchall()
     
     return [
         {"id": r[0], "username": r[1], "is_admin": bool(r[2]), "created_at": r[3]}
@@ -204,22 +383,15 @@ def get_all_users() -> list:
 
 def delete_user(user_id: int) -> tuple[bool, str]:
     """删除用户"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
-    # 检查用户是否存在且非管理员
-    c.execute("SELECT username, is_admin FROM users WHERE id = ?", (user_id,))
-    row = c.fetchone()
-    if not row:
-        conn.close()
-        return False, "用户不存在"
-    if row[1]:  # is_admin
-        conn.close()
-        return False, "不能删除管理员"
-    
-    c.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    conn = get_conn()
+    with conn:
+        # 检查用户是否存在且非管理员
+        row = conn.execute(SQL_USER_BY_ID, (user_id,)).fetchone()
+        if not row:
+            return False, "用户不存在"
+        if row[1]:  # is_admin
+            return False, "不能删除管理员"
+        conn.execute(SQL_DELETE_USER, (user_id,))
     return True, f"用户 {row[0]} 已删除"
 
 
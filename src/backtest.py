@@ -1,10 +1,23 @@
 """
-回测引擎 - 纯 Pandas 向量化实现，无任何外部框架
+回测引擎 - Pandas 计算因子 + NumPy 逐周撮合，无任何外部框架
 """
 import pandas as pd
 import numpy as np
+from enum import IntEnum
 from typing import Optional
 
+try:
+    from numba import njit, prange
+    HAS_NUMBA = True
+except ImportError:  # 未安装 numba 时退回纯 Python 执行
+    HAS_NUMBA = False
+    prange = range
+    
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
 
 def compute_momentum(prices: pd.DataFrame, window: int = 20) -> pd.DataFrame:
     """
@@ -20,24 +33,279 @@ def compute_momentum(prices: pd.DataFrame, window: int = 20) -> pd.DataFrame:
     return prices.pct_change(window)
 
 
-def compute_volatility(prices: pd.DataFrame, window: int = 20) -> pd.DataFrame:
+def compute_volatility(prices: pd.DataFrame, window: int = 20, daily_ret: Optional[pd.DataFrame] = None) -> pd.DataFrame:
     """
     计算波动率: 过去 N 天日收益的标准差
+    
+    daily_ret: 预先算好的 prices.pct_change()，多个窗口反复计算时可复用
     """
-    daily_ret = prices.pct_change()
+    if daily_ret is None:
+        daily_ret = prices.pct_change()
     return daily_ret.rolling(window).std()
 
 
-def compute_score(prices: pd.DataFrame, momentum_days: int = 20) -> pd.DataFrame:
+def compute_score(prices: pd.DataFrame, momentum_days: int = 20, daily_ret: Optional[pd.DataFrame] = None) -> pd.DataFrame:
     """
     计算综合得分: 动量 / 波动率 (风险调整后的动量)
     """
     mom = compute_momentum(prices, momentum_days)
-    vol = compute_volatility(prices, momentum_days)
+    vol = compute_volatility(prices, momentum_days, daily_ret)
     vol = vol.replace(0, np.nan).clip(lower=0.001)  # 避免除零
     return mom / vol
 
 
+@njit(cache=True, parallel=True)
+def _score_rows_kernel(closes, rows, w, out):
+    """
+    逐标的并行：对每个调仓行在 [r-w+1, r] 窗口内现算日收益、两遍法求样本标准差，
+    与动量一起写出得分，不生成日收益矩阵与滑动窗口副本 (累加用 float64)
+    """
+    n_sym = closes.shape[1]
+    for j in prange(n_sym):
+        for k in range(len(rows)):
+            r = rows[k]
+            if r < w:
+                continue
+            mean = 0.0
+            for t in range(r - w + 1, r + 1):
+                mean += closes[t, j] / closes[t - 1, j] - 1.0
+            mean /= w
+            ss = 0.0
+            for t in range(r - w + 1, r + 1):
+                d = closes[t, j] / closes[t - 1, j] - 1.0 - mean
+                ss += d * d
+            vol = np.sqrt(ss / (w - 1))
+            mom = closes[r, j] / closes[r - w, j] - 1.0
+            if vol == 0:
+                out[k, j] = np.nan
+            else:
+                out[k, j] = mom / max(vol, 0.001)  # 避免除零
+
+
+def compute_score_rows(closes: np.ndarray, rows: np.ndarray, momentum_days: int = 20,
+                       daily_ret: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    一次性计算指定行的综合得分 (与 compute_score 口径一致)
+    
+    Args:
+        closes: 日收盘价矩阵 (T x N)，不含 NaN；结果沿用其精度 (float32/float64)
+        rows: 需要得分的行号 (如每周最后一个交易日)
+        momentum_days: 动量/波动率回看天数
+        daily_ret: 预先算好的日收益 closes[1:] / closes[:-1] - 1，
+            同一价格矩阵扫描多个回看窗口时传入以免重复计算
+    
+    Returns:
+        得分矩阵 (len(rows) x N)，回看期不足的行为 NaN
+    """
+    w = momentum_days
+    out = np.full((len(rows), closes.shape[1]), np.nan, dtype=closes.dtype)
+    if HAS_NUMBA and daily_ret is None and w > 1:
+        _score_rows_kernel(closes, np.asarray(rows, dtype=np.int64), w, out)
+        return out
+    
+    valid = rows >= w
+    r = rows[valid]
+    if len(r) == 0:
+        return out
+    
+    mom = closes[r] / closes[r - w] - 1
+    if daily_ret is None:
+        daily_ret = closes[1:] / closes[:-1] - 1
+    # daily_ret[t-1] 对应第 t 日收益，窗口为 [r-w+1, r]
+    windows = np.lib.stride_tricks.sliding_window_view(daily_ret, w, axis=0)[r - w]
+    vol = windows.std(axis=-1, ddof=1)
+    vol = np.where(vol == 0, np.nan, np.maximum(vol, 0.001))  # 避免除零
+    out[valid] = mom / vol
+    return out
+
+
+class TradeSide(IntEnum):
+    """成交方向：撮合内核内按整数记录，输出时再转为 "BUY"/"SELL" """
+    SELL = -1
+    BUY = 1
+
+
+_WEEKDAYS = {"MON": 0, "TUE": 1, "WED": 2, "THU": 3, "FRI": 4, "SAT": 5, "SUN": 6}
+
+
+def period_end_rows(index: pd.DatetimeIndex, freq: str = "W-FRI") -> tuple[np.ndarray, pd.DatetimeIndex]:
+    """
+    每个调仓周期最后一个交易日的行号及周期标签 (与 resample(freq).last() 对齐)
+    
+    周频/月频直接对日期整数求周期序号，再差分找周期切换点，一次向量运算完成；其他频率退回 resample
+    """
+    if freq == "W" or (freq.startswith("W-") and freq[2:] in _WEEKDAYS):
+        anchor = _WEEKDAYS[freq[2:]] if freq != "W" else 6
+        days = index.values.astype("datetime64[D]").astype(np.int64)  # 1970-01-01 为周四
+        period_id = (days + 2 - anchor) // 7  # 周期为 (锚定日, 下一锚定日]
+        to_label = lambda ids: (ids * 7 + anchor + 4).astype("datetime64[D]")
+    elif freq in ("ME", "M"):
+        period_id = index.values.astype("datetime64[M]").astype(np.int64)
+        to_label = lambda ids: (ids + 1).astype("datetime64[M]").astype("datetime64[D]") - 1  # 月末
+    else:
+        period_end = pd.Series(np.arange(len(index)), index=index).resample(freq).last().dropna()
+        return period_end.to_numpy(dtype=np.int64), period_end.index
+    
+    rows = np.flatnonzero(np.r_[period_id[1:] != period_id[:-1], len(period_id) > 0])
+    labels = pd.DatetimeIndex(to_label(period_id[rows]).astype(index.values.dtype), name=index.name)
+    return rows, labels
+
+
+@njit(cache=True)
+def _last_valid_by_group(values, group, n_groups):
+    """按行顺序扫描一遍，记录每组每列最后一个非 NaN 值 (group 需单调不减)"""
+    out = np.full((n_groups, values.shape[1]), np.nan)
+    for i in range(values.shape[0]):
+        g = group[i]
+        for j in range(values.shape[1]):
+            v = values[i, j]
+            if not np.isnan(v):
+                out[g, j] = v
+    return out
+
+
+def top_k_stable(sort_key: np.ndarray, k: int) -> np.ndarray:
+    """
+    逐行取 sort_key 最小的 k 个列号，结果与 np.argsort(kind="stable")[:, :k] 完全一致
+    
+    先用 np.partition 找第 k 小的阈值 (O(N))，阈值处的并列按列号取前几个，
+    再只对选中的 k 列做稳定排序，避免每行整体排序
+    """
+    n_rows, n_cols = sort_key.shape
+    if k >= n_cols:
+        return np.argsort(sort_key, axis=1, kind="stable")
+    kth = np.partition(sort_key, k - 1, axis=1)[:, k - 1:k]
+    below = sort_key < kth
+    tie = sort_key == kth
+    fill = k - below.sum(axis=1, keepdims=True)
+    selected = below | (tie & (np.cumsum(tie, axis=1) <= fill))
+    # 每行恰好选中 k 列，nonzero 按行优先返回，列号升序
+    sel_idx = np.nonzero(selected)[1].reshape(n_rows, k)
+    order = np.argsort(np.take_along_axis(sort_key, sel_idx, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(sel_idx, order, axis=1)
+
+
+def resample_last(prices: pd.DataFrame, freq: str = "ME") -> pd.DataFrame:
+    """
+    降频取每期最后一个有效值，等价于 resample(freq).last() 去掉无交易日的空周期
+    
+    周期切分复用 period_end_rows，取值由编译内核单遍完成
+    """
+    rows, labels = period_end_rows(prices.index, freq)
+    group = np.repeat(np.arange(len(rows)), np.diff(rows, prepend=-1))
+    values = _last_valid_by_group(prices.to_numpy(dtype=np.float64), group, len(rows))
+    return pd.DataFrame(values, index=labels, columns=prices.columns)
+
+
+@njit(cache=True)
+def _run_weekly(closes, winners, initial_capital, commission_rate, sell_factor, buy_factor):
+    """
+    逐周撮合内核 (numba 编译，仅使用数组与标量)
+    
+    Args:
+        closes: 调仓日收盘价 (W x N)
+        winners: 第 i 周的目标标的列号 ((W-1) x K)，-1 表示空位
+    
+    Returns:
+        (净值, 峰值, 每周佣金, 期末持股, 期末现金,
+         成交周序号, 成交标的列号, 成交方向(TradeSide), 成交股数, 成交价)
+    """
+    n_weeks, n_sym = closes.shape
+    portfolio_value = np.empty(n_weeks)
+    peak_value = np.empty(n_weeks)
+    portfolio_value[0] = initial_capital
+    peak_value[0] = initial_capital
+    week_commission = np.zeros(n_weeks)
+    cash = initial_capital
+    holdings = np.zeros(n_sym)  # 各标的持股数
+    
+    max_trades = max(n_weeks - 1, 0) * (n_sym + winners.shape[1])
+    trade_week = np.empty(max_trades, dtype=np.int64)
+    trade_sym = np.empty(max_trades, dtype=np.int64)
+    trade_side = np.empty(max_trades, dtype=np.int8)
+    trade_shares = np.empty(max_trades)
+    trade_price = np.empty(max_trades)
+    n_trades = 0
+    
+    is_target = np.zeros(n_sym, dtype=np.bool_)
+    for i in range(1, n_weeks):
+        curr_prices = closes[i]
+        
+        # 计算持仓市值
+        total_value = cash
+        for j in range(n_sym):
+            total_value += holdings[j] * curr_prices[j]
+        
+        # 目标标的与权重
+        is_target[:] = False
+        n_win = 0
+        week_winners = winners[i - 1]
+        for k in range(week_winners.shape[0]):
+            if week_winners[k] >= 0:
+                is_target[week_winners[k]] = True
+                n_win += 1
+        # 每只目标的目标市值本周内不变，循环外算一次
+        target_value = total_value * (1.0 / n_win) if n_win else 0.0
+        
+        # 先卖: 不在目标中的持仓一次性清空；逐只标量累加，不再每周生成下标/价格/佣金临时数组
+        sell_net = 0.0
+        sell_comm = 0.0
+        for j in range(n_sym):
+            if holdings[j] > 0 and not is_target[j]:
+                sell_price = curr_prices[j] * sell_factor
+                proceeds = holdings[j] * sell_price
+                comm = max(proceeds * commission_rate, 5.0) if proceeds > 0 else 0.0
+                sell_net += proceeds - comm
+                sell_comm += comm
+                trade_week[n_trades] = i
+                trade_sym[n_trades] = j
+                trade_side[n_trades] = TradeSide.SELL
+                trade_shares[n_trades] = holdings[j]
+                trade_price[n_trades] = sell_price
+                n_trades += 1
+                holdings[j] = 0
+        cash += sell_net
+        week_commission[i] += sell_comm
+        
+        # 再买
+        for k in range(week_winners.shape[0]):
+            j = week_winners[k]
+            if j < 0:
+                continue
+            diff = target_value - holdings[j] * curr_prices[j]
+            
+            if diff > 100:  # 只有差额大于100元才交易
+                price = curr_prices[j] * buy_factor
+                # 保持先除价格再除100的顺序，改写成 diff // (price*100) 会在整百边界处改变舍入
+                shares_to_buy = int(diff / price / 100) * 100  # 整百股
+                if shares_to_buy > 0:
+                    cost = shares_to_buy * price
+                    comm = max(cost * commission_rate, 5.0)  # 最低5元
+                    if cash >= cost + comm:
+                        cash -= cost + comm
+                        holdings[j] += shares_to_buy
+                        week_commission[i] += comm
+                        trade_week[n_trades] = i
+                        trade_sym[n_trades] = j
+                        trade_side[n_trades] = TradeSide.BUY
+                        trade_shares[n_trades] = shares_to_buy
+                        trade_price[n_trades] = price
+                        n_trades += 1
+        
+        # 记录
+        total_value = cash
+        for j in range(n_sym):
+            total_value += holdings[j] * curr_prices[j]
+        portfolio_value[i] = total_value
+        peak_value[i] = max(peak_value[i - 1], total_value)
+    
+    return (
+        portfolio_value, peak_value, week_commission, holdings, cash,
+        trade_week[:n_trades], trade_sym[:n_trades], trade_side[:n_trades],
+        trade_shares[:n_trades], trade_price[:n_trades],
+    )
+
+
 def backtest(
     prices: pd.DataFrame,
     equity_symbols: list[str],
@@ -66,116 +334,90 @@ def backtest(
     Returns:
         回测结果字典
     """
-    # 确保有数据
+    # 转为 NumPy 矩阵，循环内只做整数下标访问；缺数据的行用布尔掩码剔除，不再经 dropna 复制整张表
     all_symbols = equity_symbols + [bond_symbol]
-    prices = prices[all_symbols].dropna()
+    daily_closes = prices[all_symbols].to_numpy(dtype=np.float64)   # (T, N)
+    index = prices.index
+    complete = ~np.isnan(daily_closes).any(axis=1)
+    if not complete.all():
+        daily_closes = daily_closes[complete]
+        index = index[complete]
     
-    if len(prices) < momentum_days + 10:
+    if len(daily_closes) < momentum_days + 10:
         return {"error": "数据不足"}
     
-    # 计算得分 (只对权益类)
-    scores = compute_score(prices[equity_symbols], momentum_days)
+    # 调仓日 (每周五) 对应的日线行号，整周休市的空周自然被剔除
+    week_rows, dates = period_end_rows(index, rebalance_freq)
+    closes = daily_closes[week_rows]                   # (W, N)
+    # 得分只在调仓日计算一次 (只对权益类)，只用于排序，float32 足够且内存减半
+    equity_closes = np.ascontiguousarray(daily_closes[:, :len(equity_symbols)], dtype=np.float32)
+    score_mat = compute_score_rows(equity_closes, week_rows, momentum_days)  # (W, E)
+    bond_idx = len(all_symbols) - 1
     
-    # 生成调仓信号 (每周五)
-    weekly = prices.resample(rebalance_freq).last()
-    weekly_scores = scores.resample(rebalance_freq).last()
+    # 选股信号一次算完: 第 i 周按第 i-1 周得分排序取前 N 只 (NaN 排在最后)
+    # 无有效得分的周回退到避险资产，其余位置以 -1 补齐
+    signal_scores = score_mat[:-1]
+    sort_key = np.where(np.isnan(signal_scores), np.inf, -signal_scores)
+    if hold_count == 1:
+        # 只持有一只时取最优即可，argmin 返回首个最小值，与稳定排序的第一名一致
+        winners = sort_key.argmin(axis=1)[:, None]
+    else:
+        winners = top_k_stable(sort_key, hold_count)
+    no_signal = np.isnan(signal_scores).all(axis=1)
+    winners[no_signal] = -1
+    winners[no_signal, 0] = bond_idx
     
-    # 初始化持仓
-    portfolio_value = [initial_capital]
-    positions = pd.DataFrame(0.0, index=weekly.index, columns=all_symbols)
-    cash = initial_capital
-    holdings = {}  # {symbol: shares}
+    (portfolio_value, peak_value, week_commission, holdings, cash,
+     trade_week, trade_sym, trade_side, trade_shares, trade_price) = _run_weekly(
+        closes, winners.astype(np.int64), float(initial_capital), commission_rate,
+        1 - slippage_bps / 10000, 1 + slippage_bps / 10000,
+    )
     
-    rebalance_records = []
+    # 成交明细按列存放 (trade_week 递增)，只为最近 20 个调仓周组装字典
+    reb_weeks, starts = np.unique(trade_week, return_index=True)
+    bounds = np.append(starts, len(trade_week))
+    first = max(len(reb_weeks) - 20, 0)
+    reb_dates = dates[reb_weeks[first:]].strftime("%Y-%m-%d")
+    # 各字段整列转换为 Python 对象后再按行拼装，避免逐笔下标与类型转换
+    lo = bounds[first]
+    trades = [
+        {"symbol": sym, "action": side, "shares": shares, "price": price}
+        for sym, side, shares, price in zip(
+            np.asarray(all_symbols, dtype=object)[trade_sym[lo:]].tolist(),
+            np.where(trade_side[lo:] == TradeSide.BUY, TradeSide.BUY.name, TradeSide.SELL.name).tolist(),
+            trade_shares[lo:].astype(np.int64).tolist(),
+            trade_price[lo:].tolist(),
+        )
+    ]
+    rebalance_records = [
+        {
+            "date": date_str,
+            "trades": trades[bounds[k] - lo:bounds[k + 1] - lo],
+            "value": float(portfolio_value[reb_weeks[k]]),
+            "commission": float(week_commission[reb_weeks[k]]),
+        }
+        for k, date_str in zip(range(first, len(reb_weeks)), reb_dates)
+    ]
     
-    for i, date in enumerate(weekly.index[1:], 1):
-        prev_date = weekly.index[i-1]
-        
-        # 获取当前价格
-        curr_prices = weekly.loc[date]
-        prev_prices = weekly.loc[prev_date]
-        
-        # 计算持仓市值
-        mkt_value = sum(holdings.get(s, 0) * curr_prices[s] for s in all_symbols)
-        total_value = cash + mkt_value
-        
-        # 选股: 得分最高的 N 只
-        if not weekly_scores.loc[prev_date].isna().all():
-            ranked = weekly_scores.loc[prev_date].sort_values(ascending=False)
-            winners = ranked.head(hold_count).index.tolist()
-        else:
-            winners = [bond_symbol]  # fallback
-        
-        # 目标权重
-        target_weight = 1.0 / len(winners) if winners else 0
-        target_holdings = {s: target_weight for s in winners}
-        
-        # 调仓
-        trades = []
-        slippage_cost = 0
-        commission_cost = 0
-        
-        # 先卖
-        for sym in list(holdings.keys()):
-            if sym not in target_holdings or target_holdings[sym] == 0:
-                shares = holdings.pop(sym, 0)
-                if shares > 0:
-                    price = curr_prices[sym] * (1 - slippage_bps / 10000)
-                    proceeds = shares * price
-                    comm = max(proceeds * commission_rate, 5)  # 最低5元
-                    cash += proceeds - comm
-                    commission_cost += comm
-                    trades.append({"symbol": sym, "action": "SELL", "shares": shares, "price": price})
-        
-        # 再买
-        for sym in winners:
-            target_value = total_value * target_weight
-            current_value = holdings.get(sym, 0) * curr_prices[sym]
-            diff = target_value - current_value
-            
-            if diff > 100:  # 只有差额大于100元才交易
-                price = curr_prices[sym] * (1 + slippage_bps / 10000)
-                shares_to_buy = int(diff / price / 100) * 100  # 整百股
-                if shares_to_buy > 0:
-                    cost = shares_to_buy * price
-                    comm = max(cost * commission_rate, 5)
-                    if cash >= cost + comm:
-                        cash -= cost + comm
-                        holdings[sym] = holdings.get(sym, 0) + shares_to_buy
-                        commission_cost += comm
-                        trades.append({"symbol": sym, "action": "BUY", "shares": shares_to_buy, "price": price})
-        
-        # 记录
-        mkt_value = sum(holdings.get(s, 0) * curr_prices[s] for s in all_symbols)
-        total_value = cash + mkt_value
-        portfolio_value.append(total_value)
-        
-        if trades:
-            rebalance_records.append({
-                "date": date.strftime("%Y-%m-%d"),
-                "trades": trades,
-                "value": total_value,
-                "commission": commission_cost
-            })
-    
-    # 构建净值曲线
-    nav = pd.Series(portfolio_value, index=weekly.index[:len(portfolio_value)])
-    nav = nav / nav.iloc[0]  # 归一化
+    # 构建净值曲线（归一化），统计指标直接在数组上计算，不构造中间 Series
+    nav = portfolio_value / portfolio_value[0]
     
     # 计算统计指标
-    returns = nav.pct_change().dropna()
-    total_return = (nav.iloc[-1] / nav.iloc[0] - 1) * 100
+    returns = nav[1:] / nav[:-1] - 1
+    returns = returns[~np.isnan(returns)]
+    ret_std = returns.std(ddof=1) if len(returns) > 1 else 0.0
+    total_return = (nav[-1] / nav[0] - 1) * 100
     annual_return = total_return / (len(nav) / 52) if len(nav) > 52 else total_return
-    max_drawdown = ((nav.cummax() - nav) / nav.cummax()).max() * 100
-    sharpe = returns.mean() / returns.std() * np.sqrt(52) if returns.std() > 0 else 0
+    max_drawdown = ((peak_value - portfolio_value) / peak_value).max() * 100
+    sharpe = returns.mean() / ret_std * np.sqrt(52) if ret_std > 0 else 0
     
     return {
         "total_return": round(total_return, 2),
         "annual_return": round(annual_return, 2),
         "max_drawdown": round(max_drawdown, 2),
         "sharpe": round(sharpe, 2),
-        "nav": nav.to_dict(),
-        "rebalances": rebalance_records[-20:],  # 最近20条
-        "final_holdings": holdings,
-        "final_cash": cash,
+        "nav": dict(zip(dates.strftime("%Y-%m-%d"), nav.tolist())),  # 日期整列格式化一次
+        "rebalances": rebalance_records,  # 最近20条
+        "final_holdings": {all_symbols[j]: int(holdings[j]) for j in np.flatnonzero(holdings)},
+        "final_cash": float(cash),
     }
@@ -1,13 +1,26 @@
 """
 数据服务模块 - 使用 AKShare 获取 ETF 日线数据，Parquet 本地缓存
-支持返回月频数据供 BT 库使用
+支持返回月频数据供策略回测与信号使用
 """
 import pandas as pd
-import akshare as ak
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
 import logging
 import json
+import os
+import threading
+import uuid
+
+try:
+    import polars as pl
+except ImportError:  # polars 为可选依赖，未安装时使用 pandas/pyarrow 读取
+    pl = None
 
 logger = logging.getLogger(__name__)
 
@@ -16,30 +29,157 @@ DATA_DIR.mkdir(exist_ok=True)
 
 CONFIG_PATH = Path(__file__).parent.parent / "config.json"
 
+# 日线缓存压缩算法：zstd 压缩率高于默认 snappy，解码速度相当
+PARQUET_COMPRESSION = "zstd"
+# 每个 row group 约四年日线：_read_tail 只需解码最后一个 row group，压缩率也基本不受影响
+PARQUET_ROW_GROUP_SIZE = 1024
+
+# 价格列落盘为 float32（读盘量减半）；ETF 最小价位 0.001，读回时转 float64 并按 3 位小数还原
+# float32 有效数字约 7 位：绝对值小于 2^13 时舍入误差不超过 2^-11 < 0.0005，可按 3 位小数精确还原；
+# 超出该范围或不在 0.001 价位上的列（如指数点位、复权价）仍按 float64 原样保存
+PRICE_COLUMNS = ("open", "high", "low", "close")
+PRICE_DECIMALS = 3
+PRICE_FLOAT32_LIMIT = 2.0 ** 13
+
+# AKShare 日线列名 -> 缓存列名（按缓存列顺序）
+AK_DAILY_COLUMNS = {
+    "日期": "date", "开盘": "open", "最高": "high",
+    "最低": "low", "收盘": "close", "成交量": "volume",
+}
+
+# 设置环境变量 USE_POLARS=1 且已安装 polars 时，用 polars 惰性扫描拼接宽表
+USE_POLARS = pl is not None and os.environ.get("USE_POLARS") == "1"
+
+# 配置按 (修改时间, 大小) 缓存，文件未变时不再重复读取解析
+_config_cache: tuple = (None, None)
+_config_lock = threading.Lock()
+
+
 def load_config() -> dict:
-    return json.loads(CONFIG_PATH.read_text())
+    """读取配置；返回的是共享对象，调用方不要原地修改"""
+    global _config_cache
+    st = CONFIG_PATH.stat()
+    key = (st.st_mtime_ns, st.st_size)
+    with _config_lock:
+        if _config_cache[0] != key:
+            _config_cache = (key, json.loads(CONFIG_PATH.read_text()))
+        return _config_cache[1]
+
+
+# 由配置派生的代码列表与资产信息，配置对象不变时复用
+_config_views_cache: tuple = (None, None)
+
+
+def _config_views() -> tuple[list, dict]:
+    """一次遍历配置得到 (全部代码, 资产信息)，配置重新加载后才重建"""
+    global _config_views_cache
+    cfg = load_config()
+    if _config_views_cache[0] is not cfg:
+        assets = cfg["assets"]
+        info = {}
+        for a in assets["risk"]:
+            info[a["code"]] = {"name": a["name"], "desc": a.get("desc", ""), "type": "risk"}
+        for a in assets["defensive"]:
+            info[a["code"]] = {"name": a["name"], "weight": a["weight"], "type": "defensive"}
+        # 按配置顺序去重，列顺序稳定
+        symbols = list(dict.fromkeys(a["code"] for group in ("risk", "defensive") for a in assets[group]))
+        _config_views_cache = (cfg, (symbols, info))
+    return _config_views_cache[1]
 
 
 def get_all_symbols() -> list:
     """获取配置中所有 ETF 代码"""
-    cfg = load_config()
-    codes = []
-    for a in cfg["assets"]["risk"]:
-        codes.append(a["code"])
-    for a in cfg["assets"]["defensive"]:
-        codes.append(a["code"])
-    return list(set(codes))
+    return list(_config_views()[0])
 
 
 def get_asset_info() -> dict:
-    """返回资产信息 {code: {name, desc/weight, type}}"""
-    cfg = load_config()
-    info = {}
-    for a in cfg["assets"]["risk"]:
-        info[a["code"]] = {"name": a["name"], "desc": a.get("desc", ""), "type": "risk"}
-    for a in cfg["assets"]["defensive"]:
-        info[a["code"]] = {"name": a["name"], "weight": a["weight"], "type": "defensive"}
-    return info
+    """返回资产信息 {code: {name, desc/weight, type}}；共享对象，调用方不要原地修改"""
+    return _config_views()[1]
+
+
+# 按任务类型分开的常驻线程池：网络下载、parquet 读取各用各的队列，
+# 全量更新时不会占满读取线程，图表/回测的读请求照常处理
+_download_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="etf-download")
+_read_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="parquet-read")
+# 同一时刻只跑一次全量更新（定时任务与手动触发可能重叠）
+_update_lock = threading.Lock()
+
+# 行情缓存写盘放到单独的 I/O 线程，请求（如图表接口）不必等待落盘；
+# 单线程保证同一文件的写入按提交顺序进行
+_io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parquet-io")
+# 已提交但尚未落盘的数据，落盘前的读取以此为准，避免重复下载
+_pending_writes: dict = {}
+_pending_lock = threading.Lock()
+
+
+def _submit_parquet_write(df: pd.DataFrame, path: Path):
+    """提交异步写盘"""
+    with _pending_lock:
+        _pending_writes[path] = df
+    _io_executor.submit(_write_parquet, df, path)
+
+
+def _float32_lossless(values: pd.Series) -> bool:
+    """价格列能否存为 float32 后按 PRICE_DECIMALS 位小数精确还原"""
+    arr = values.to_numpy(dtype=np.float64)
+    finite = arr[~np.isnan(arr)]
+    return bool(
+        (np.abs(finite) < PRICE_FLOAT32_LIMIT).all()
+        and (np.round(finite, PRICE_DECIMALS) == finite).all()
+    )
+
+
+def _write_parquet(df: pd.DataFrame, path: Path):
+    """先写临时文件再原子替换，读取方不会看到写了一半的文件"""
+    # 临时文件名按写入方唯一，并发写同一路径时互不覆盖
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+    try:
+        prices = [c for c in PRICE_COLUMNS if c in df.columns]
+        stored = df.astype({c: "float32" for c in prices if _float32_lossless(df[c])})
+        # 价格列用 BYTE_STREAM_SPLIT 编码，按字节分组后 zstd 压缩效果更好
+        stored.to_parquet(
+            tmp, compression=PARQUET_COMPRESSION,
+            row_group_size=PARQUET_ROW_GROUP_SIZE,
+            use_byte_stream_split=prices,
+            use_dictionary=[c for c in stored.columns if c not in prices],
+        )
+        os.replace(tmp, path)
+        logger.info("%s 已保存 %s 条记录", path.stem, len(df))
+    except Exception as e:
+        logger.error("保存 %s 失败: %s", path.name, e)
+        tmp.unlink(missing_ok=True)
+    finally:
+        with _pending_lock:
+            if _pending_writes.get(path) is df:
+                del _pending_writes[path]
+
+
+def flush_pending_writes():
+    """等待已提交的缓存写盘全部完成"""
+    _io_executor.submit(lambda: None).result()
+
+
+def _restore_prices(table: pa.Table) -> pa.Table:
+    """float32 价格列转回 float64 并还原到最小价位，下游计算仍按 float64 进行"""
+    for name in PRICE_COLUMNS:
+        i = table.schema.get_field_index(name)
+        if i >= 0 and table.schema.field(i).type == pa.float32():
+            values = np.round(table.column(i).to_numpy().astype(np.float64), PRICE_DECIMALS)
+            table = table.set_column(i, name, pa.array(values))
+    return table
+
+
+@lru_cache(maxsize=64)
+def _read_daily_table(path: Path, mtime_ns: int, size: int) -> pa.Table:
+    """按 (路径, 修改时间, 大小) 缓存解码后的 Arrow 表；Arrow 表不可变，调用方各自 to_pandas"""
+    return _restore_prices(pq.read_table(path, memory_map=True))
+
+
+def _has_weekday(start: str, end: str) -> bool:
+    """[start, end] (YYYYMMDD) 内是否有周一至周五"""
+    begin = np.datetime64(f"{start[:4]}-{start[4:6]}-{start[6:]}")
+    stop = np.datetime64(f"{end[:4]}-{end[4:6]}-{end[6:]}") + 1
+    return bool(np.busday_count(begin, stop))
 
 
 def get_etf_daily(symbol: str, start: str = "20100101", end: str = None) -> pd.DataFrame:
@@ -51,29 +191,36 @@ def get_etf_daily(symbol: str, start: str = "20100101", end: str = None) -> pd.D
     
     cache_path = DATA_DIR / f"{symbol}.parquet"
     
-    # 尝试读取缓存
+    # 尝试读取缓存（尚未落盘的最新数据优先）
     cached_df = pd.DataFrame()
-    if cache_path.exists():
+    with _pending_lock:
+        pending = _pending_writes.get(cache_path)
+    if pending is not None:
+        cached_df = pending.copy()
+    elif cache_path.exists():
         try:
-            cached_df = pd.read_parquet(cache_path)
+            st = cache_path.stat()
+            cached_df = _read_daily_table(cache_path, st.st_mtime_ns, st.st_size).to_pandas()
             cached_df["date"] = pd.to_datetime(cached_df["date"])
         except Exception as e:
-            logger.warning(f"缓存损坏，将重新下载: {e}")
+            logger.warning("缓存损坏，将重新下载: %s", e)
             cache_path.unlink()
     
     # 计算需要下载的日期范围
     if not cached_df.empty:
         last_date = cached_df["date"].max()
         fetch_start = (last_date + timedelta(days=1)).strftime("%Y%m%d")
-        if fetch_start > end:
-            logger.info(f"{symbol} 数据已是最新")
+        # 区间内没有工作日（如周末触发更新）也不会有新数据，不必发起网络请求
+        if fetch_start > end or not _has_weekday(fetch_start, end):
+            logger.debug("%s 数据已是最新", symbol)  # 图表接口每次请求都会走到这里
             return cached_df
     else:
         fetch_start = start
     
-    # 从 AKShare 下载
-    logger.info(f"下载 {symbol}: {fetch_start} -> {end}")
+    # 从 AKShare 下载（akshare 导入很重，只在确实需要下载时加载）
+    logger.info("下载 %s: %s -> %s", symbol, fetch_start, end)
     try:
+        import akshare as ak
         df = ak.fund_etf_hist_em(
             symbol=symbol, 
             period="daily", 
@@ -81,51 +228,94 @@ def get_etf_daily(symbol: str, start: str = "20100101", end: str = None) -> pd.D
             end_date=end
         )
     except Exception as e:
-        logger.error(f"下载 {symbol} 失败: {e}")
+        logger.error("下载 %s 失败: %s", symbol, e)
         return cached_df
     
     if df.empty:
         return cached_df
     
-    # 标准化列名
-    df = df.rename(columns={
-        "日期": "date", "开盘": "open", "收盘": "close",
-        "最高": "high", "最低": "low", "成交量": "volume"
-    })
+    # 标准化列名：先只取需要的列再重命名，避免复制和处理无用列
+    df = df[list(AK_DAILY_COLUMNS)].rename(columns=AK_DAILY_COLUMNS)
     df["date"] = pd.to_datetime(df["date"])
-    df = df[["date", "open", "high", "low", "close", "volume"]]
     
-    # 合并缓存
+    # 新下载的一段只有几行，整理顺序/去重只在这一段上做
+    if not df["date"].is_monotonic_increasing:
+        df = df.sort_values("date")
+    if df["date"].duplicated().any():
+        df = df.drop_duplicates("date", keep="last")
+    
+    # 合并缓存：缓存本身有序，在新数据起始日处截断后直接追加，无需整表去重排序
     if not cached_df.empty:
-        df = pd.concat([cached_df, df]).drop_duplicates("date").sort_values("date")
+        cut = cached_df["date"].searchsorted(df["date"].iloc[0], side="left")
+        df = pd.concat([cached_df.iloc[:cut], df], ignore_index=True)
+    else:
+        df = df.reset_index(drop=True)
     
     # 保存
-    df.reset_index(drop=True).to_parquet(cache_path)
-    logger.info(f"{symbol} 已保存 {len(df)} 条记录")
+    _submit_parquet_write(df, cache_path)
     
     return df
 
 
+def is_updating() -> bool:
+    """是否有全量更新正在进行"""
+    return _update_lock.locked()
+
+
 def update_universe() -> dict:
-    """更新所有配置中的 ETF 数据"""
+    """更新所有配置中的 ETF 数据；已有更新在跑时直接返回空结果"""
+    if not _update_lock.acquire(blocking=False):
+        logger.info("数据更新已在进行中，跳过本次触发")
+        return {}
+    try:
+        return _update_universe()
+    finally:
+        _update_lock.release()
+
+
+def _current_cache_summary(path: Path, end: str) -> Optional[tuple[int, str]]:
+    """缓存已覆盖到 end（之后没有工作日）时返回 (行数, 最后日期)，只读 parquet 元数据；否则返回 None"""
+    with _pending_lock:
+        if path in _pending_writes:
+            return None
+    if not path.exists():
+        return None
+    rows, last_date = _file_summary(path)
+    if last_date is None:
+        return None
+    fetch_start = (pd.Timestamp(last_date) + timedelta(days=1)).strftime("%Y%m%d")
+    if fetch_start > end or not _has_weekday(fetch_start, end):
+        return rows, last_date
+    return None
+
+
+def _update_universe() -> dict:
     symbols = get_all_symbols()
-    results = {}
     asset_info = get_asset_info()
+    end = datetime.now().strftime("%Y%m%d")
     
-    for sym in symbols:
+    def update_one(sym: str) -> dict:
         try:
-            df = get_etf_daily(sym)
             name = asset_info.get(sym, {}).get("name", sym)
-            results[sym] = {
+            # 已是最新的标的无需下载，也不必为了汇报行数和日期加载整表
+            current = _current_cache_summary(DATA_DIR / f"{sym}.parquet", end)
+            if current is not None:
+                return {"status": "ok", "rows": current[0], "name": name, "last_date": current[1]}
+            df = get_etf_daily(sym, end=end)
+            return {
                 "status": "ok", 
                 "rows": len(df),
                 "name": name,
                 "last_date": str(df["date"].max())[:10] if len(df) > 0 else None
             }
         except Exception as e:
-            results[sym] = {"status": "error", "message": str(e)}
+            return {"status": "error", "message": str(e)}
     
-    # 记录更新时间
+    # 下载以网络等待为主，多线程并发拉取；每个标的写各自的缓存文件，互不冲突
+    results = dict(zip(symbols, _download_executor.map(update_one, symbols)))
+    
+    # 等缓存全部落盘后再记录更新时间，之后的读取都能看到新数据
+    flush_pending_writes()
     _save_update_time()
     
     return results
@@ -138,7 +328,6 @@ def _get_update_time_path() -> Path:
 
 def _save_update_time():
     """保存数据更新时间"""
-    import json
     path = _get_update_time_path()
     data = {
         "last_update": datetime.now().isoformat(),
@@ -149,7 +338,6 @@ def _save_update_time():
 
 def get_last_update_time() -> dict:
     """获取最后更新时间"""
-    import json
     path = _get_update_time_path()
     if path.exists():
         try:
@@ -160,62 +348,156 @@ def get_last_update_time() -> dict:
 
 
 
-def load_prices_daily(symbols: list = None) -> pd.DataFrame:
-    """加载日频收盘价宽表"""
+def _read_close(path: Path) -> tuple[np.ndarray, np.ndarray]:
+    """读取单个缓存文件的 (日期, 收盘价) 数组（pyarrow 只解码 date/close 两列，不经过 pandas 对象）"""
+    table = _restore_prices(pq.read_table(path, columns=["date", "close"], memory_map=True))
+    dates = table.column("date").to_numpy()
+    if dates.dtype.kind != "M":
+        dates = pd.to_datetime(dates).values
+    return dates, table.column("close").to_numpy()
+
+
+def _read_tail(path: Path, n_rows: int, columns: list) -> pa.Table:
+    """只解码文件末尾覆盖 n_rows 行所需的 row group，返回最后 n_rows 行"""
+    pf = pq.ParquetFile(path, memory_map=True)
+    first, count = pf.num_row_groups, 0
+    while first > 0 and count < n_rows:
+        first -= 1
+        count += pf.metadata.row_group(first).num_rows
+    table = pf.read_row_groups(range(first, pf.num_row_groups), columns=columns)
+    return _restore_prices(table.slice(max(table.num_rows - n_rows, 0)))
+
+
+def load_latest_closes(symbols: list = None) -> dict:
+    """
+    各标的在最新交易日的收盘价 {代码: 价格}，与 load_prices_daily().iloc[-1] 的非空值一致
+    
+    只读每个文件的最后一行，不拼接整张宽表
+    """
+    paths, _ = price_files(symbols)
+    tails = [_read_tail(p, 1, ["date", "close"]) for p in paths]
+    last = {p.stem: (t.column("date")[0].as_py(), t.column("close")[0].as_py())
+            for p, t in zip(paths, tails) if t.num_rows}
+    if not last:
+        return {}
+    latest_date = max(d for d, _ in last.values())
+    return {code: close for code, (d, close) in last.items()
+            if d == latest_date and close is not None and close == close}
+
+
+def price_files(symbols: list = None) -> tuple[tuple, tuple]:
+    """已缓存的行情文件及其修改时间 (纳秒)，可作为下游缓存的失效键"""
     if symbols is None:
         symbols = get_all_symbols()
+    # 一次 scandir 列目录（文件类型来自目录项，无需 stat），只对命中的文件 stat 一次
+    with os.scandir(DATA_DIR) as it:
+        entries = {e.name: e for e in it if e.name.endswith(".parquet") and e.is_file()}
+    hits = [entries[name] for name in (f"{sym}.parquet" for sym in symbols) if name in entries]
+    return tuple(Path(e.path) for e in hits), tuple(e.stat().st_mtime_ns for e in hits)
+
+
+def _load_prices_polars(paths: tuple) -> pd.DataFrame:
+    """polars 惰性扫描各文件 date/close 两列，按日期外连接对齐后一次性转为 pandas"""
+    def close_column(path: Path):
+        # 与 _restore_prices 一致：只有落盘为 float32 的列需要还原到最小价位
+        close = pl.col("close").cast(pl.Float64)
+        if pl.read_parquet_schema(path)["close"] == pl.Float32:
+            close = close.round(PRICE_DECIMALS)
+        return close.alias(path.stem)
     
-    frames = []
-    for sym in symbols:
-        path = DATA_DIR / f"{sym}.parquet"
-        if not path.exists():
-            continue
-        df = pd.read_parquet(path)[["date", "close"]].rename(columns={"close": sym})
-        df["date"] = pd.to_datetime(df["date"])
-        frames.append(df.set_index("date"))
-    
-    if not frames:
+    frames = [pl.scan_parquet(p).select(pl.col("date"), close_column(p)) for p in paths]
+    wide = pl.concat(frames, how="align").collect()
+    return wide.to_pandas().set_index("date")
+
+
+@lru_cache(maxsize=8)
+def _load_prices_cached(paths: tuple, mtimes: tuple) -> pd.DataFrame:
+    """按 (文件列表, 修改时间) 缓存收盘价宽表，文件更新后自动失效"""
+    if USE_POLARS:
+        return _load_prices_polars(paths)
+    
+    # 多文件并行读取（parquet 解码会释放 GIL）
+    arrays = list(_read_executor.map(_read_close, paths))
+    
+    # 所有日期拼接后一次排序去重得到并集，再把各列按 searchsorted 位置写入预分配矩阵
+    union = np.unique(np.concatenate([dates for dates, _ in arrays]))
+    mat = np.full((len(union), len(arrays)), np.nan)
+    for j, (dates, close) in enumerate(arrays):
+        mat[np.searchsorted(union, dates), j] = close
+    return pd.DataFrame(mat, index=pd.DatetimeIndex(union, name="date"), columns=[p.stem for p in paths])
+
+
+def load_prices_daily(symbols: list = None) -> pd.DataFrame:
+    """加载日频收盘价宽表"""
+    paths, mtimes = price_files(symbols)
+    if not paths:
         return pd.DataFrame()
     
-    return pd.concat(frames, axis=1).sort_index()
+    # 返回副本，避免调用方修改缓存
+    return _load_prices_cached(paths, mtimes).copy()
 
 
-def load_prices_monthly(symbols: list = None) -> pd.DataFrame:
-    """加载月频收盘价宽表（月末）- 供 BT 库使用"""
-    daily = load_prices_daily(symbols)
-    if daily.empty:
-        return daily
+@lru_cache(maxsize=8)
+def _load_monthly_cached(paths: tuple, mtimes: tuple) -> pd.DataFrame:
+    """月频宽表与日频宽表共用失效键，同一批文件只降频一次"""
+    # 降频只读不写，直接用缓存的日频宽表，省去一次整表复制
+    daily = _load_prices_cached(paths, mtimes)
     
-    # 转换为月频（月末）
-    monthly = daily.resample("ME").last()
+    # 转换为月频（月末），单遍取每月最后一个有效收盘价；
+    # 回测模块会加载 numba 与编译内核，只在首次降频时导入，不拖慢其他模块导入 data
+    from backtest import resample_last
+    monthly = resample_last(daily, "ME")
     return monthly.dropna(how="all")
 
 
+def load_prices_monthly(symbols: list = None, copy: bool = True) -> pd.DataFrame:
+    """
+    加载月频收盘价宽表（月末）- 供策略回测与信号使用
+    
+    copy=False 时直接返回缓存对象，只读（或只做切片）的调用方可省去整表复制
+    """
+    paths, mtimes = price_files(symbols)
+    if not paths:
+        return pd.DataFrame()
+    
+    monthly = _load_monthly_cached(paths, mtimes)
+    # 默认返回副本，避免调用方修改缓存
+    return monthly.copy() if copy else monthly
+
+
+def _file_summary(path: Path) -> tuple[int, Optional[str]]:
+    """(行数, 最后日期)：行数取自 parquet 元数据，最后日期优先用 row group 统计值，不解码数据页"""
+    meta = pq.ParquetFile(path).metadata
+    if meta.num_rows == 0:
+        return 0, None
+    col = meta.schema.names.index("date")
+    maxes = []
+    for i in range(meta.num_row_groups):
+        stats = meta.row_group(i).column(col).statistics
+        if stats is None or not stats.has_min_max:
+            # 无统计信息（旧文件）时只读日期列
+            maxes = [pd.Timestamp(pq.read_table(path, columns=["date"]).column("date").to_numpy().max())]
+            break
+        maxes.append(stats.max)
+    return meta.num_rows, str(max(maxes))[:10]
+
+
 def get_data_status() -> dict:
     """获取数据状态"""
     symbols = get_all_symbols()
     asset_info = get_asset_info()
+    paths, _ = price_files(symbols)
+    summaries = dict(zip((p.stem for p in paths), _read_executor.map(_file_summary, paths)))
     status = {}
     
     for sym in symbols:
-        path = DATA_DIR / f"{sym}.parquet"
         info = asset_info.get(sym, {})
-        name = info.get("name", sym)
-        
-        if path.exists():
-            df = pd.read_parquet(path)
-            status[sym] = {
-                "name": name,
-                "type": info.get("type", "unknown"),
-                "rows": len(df),
-                "last_date": str(df["date"].max())[:10] if len(df) > 0 else None
-            }
-        else:
-            status[sym] = {
-                "name": name,
-                "type": info.get("type", "unknown"),
-                "rows": 0, 
-                "last_date": None
-            }
+        rows, last_date = summaries.get(sym, (0, None))
+        status[sym] = {
+            "name": info.get("name", sym),
+            "type": info.get("type", "unknown"),
+            "rows": rows,
+            "last_date": last_date,
+        }
     
     return status
@@ -1,39 +1,63 @@
 """
 共享依赖 - 认证相关依赖注入
 """
+import threading
+import time
+from collections import OrderedDict
 from fastapi import Header, HTTPException, Depends
 from typing import Optional
 
 from auth import decode_token, get_user
 
 
+# 已验签的 token 载荷缓存：键为原始 token，到 exp 过期；解码失败不缓存
+_TOKEN_CACHE_SIZE = 1024
+_token_cache: OrderedDict = OrderedDict()
+_token_cache_lock = threading.Lock()
+
+
+def _decode_token_cached(token: str) -> Optional[dict]:
+    """带缓存的 token 解码，同一 token 在有效期内只做一次 HS256 验签"""
+    now = time.time()
+    with _token_cache_lock:
+        hit = _token_cache.get(token)
+        if hit is not None:
+            if hit.get("exp", 0) > now:
+                _token_cache.move_to_end(token)
+                return hit
+            del _token_cache[token]
+    
+    payload = decode_token(token)
+    if payload:
+        with _token_cache_lock:
+            _token_cache[token] = payload
+            while len(_token_cache) > _TOKEN_CACHE_SIZE:
+                _token_cache.popitem(last=False)
+    return payload
+
+
 def get_current_user(authorization: str = Header(None)) -> Optional[dict]:
     """获取当前用户（可选）"""
-    if not authorization:
-        return None
-    try:
-        scheme, token = authorization.split(" ")
-        if scheme.lower() != "bearer":
-            return None
-    except:
+    # 只接受 "Bearer <token>" 格式的认证头，scheme 不区分大小写
+    if not authorization or authorization[:7].lower() != "bearer ":
         return None
-    payload = decode_token(token)
+    payload = _decode_token_cached(authorization[7:])
     if not payload:
         return None
     return get_user(payload.get("sub"))
 
 
-def require_user(authorization: str = Header(None)) -> dict:
+# 以下依赖通过 Depends 串联：FastAPI 在同一请求内缓存依赖结果，
+# 接口同时声明多个认证依赖时，token 解码与用户查询只做一次
+def require_user(user: Optional[dict] = Depends(get_current_user)) -> dict:
     """要求用户登录"""
-    user = get_current_user(authorization)
     if not user:
         raise HTTPException(401, "请先登录")
     return user
 
 
-def require_admin(authorization: str = Header(None)) -> dict:
+def require_admin(user: dict = Depends(require_user)) -> dict:
     """要求管理员权限"""
-    user = require_user(authorization)
     if not user.get("is_admin"):
         raise HTTPException(403, "需要管理员权限")
     return user
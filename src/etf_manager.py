@@ -2,12 +2,15 @@
 ETF 管理模块 - 联网获取 ETF 信息，动态管理资产池
 """
 import json
-import akshare as ak
+import math
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from datetime import datetime, timedelta
 import logging
 
+from data import load_config as load_cached_config
+
 logger = logging.getLogger(__name__)
 
 CONFIG_PATH = Path(__file__).parent.parent / "config.json"
@@ -17,11 +20,15 @@ CACHE_EXPIRE_HOURS = 1  # 缓存有效期1小时
 
 
 def load_config() -> dict:
+    """重新读取一份可修改的配置（增删资产前使用）；只读场景用 data.load_config 的缓存"""
     return json.loads(CONFIG_PATH.read_text())
 
 
 def save_config(config: dict):
-    CONFIG_PATH.write_text(json.dumps(config, ensure_ascii=False, indent=4))
+    # 先写临时文件再替换：按修改时间缓存配置的读取方不会读到写了一半的文件
+    tmp = CONFIG_PATH.with_suffix(".tmp")
+    tmp.write_text(json.dumps(config, ensure_ascii=False, indent=4))
+    tmp.replace(CONFIG_PATH)
 
 
 # ==================== ETF 缓存管理 ====================
@@ -52,14 +59,15 @@ def get_etf_list(force_refresh: bool = False) -> pd.DataFrame:
                 logger.info("从本地缓存加载 ETF 列表...")
                 _etf_cache = pd.read_pickle(ETF_CACHE_PATH)
                 _cache_time = file_mtime
-                logger.info(f"加载完成，共 {len(_etf_cache)} 只 ETF")
+                logger.info("加载完成，共 %s 只 ETF", len(_etf_cache))
                 return _etf_cache
         except Exception as e:
-            logger.warning(f"读取缓存失败: {e}")
+            logger.warning("读取缓存失败: %s", e)
     
     # 3. 从网络下载
     logger.info("正在从网络下载 ETF 列表（可能需要几秒钟）...")
     try:
+        import akshare as ak  # 导入很重，只在需要下载时加载
         df = ak.fund_etf_spot_em()
         # 保存到文件缓存
         DATA_DIR.mkdir(exist_ok=True)
@@ -67,10 +75,10 @@ def get_etf_list(force_refresh: bool = False) -> pd.DataFrame:
         # 更新内存缓存
         _etf_cache = df
         _cache_time = datetime.now()
-        logger.info(f"下载完成，共 {len(df)} 只 ETF，已缓存")
+        logger.info("下载完成，共 %s 只 ETF，已缓存", len(df))
         return df
     except Exception as e:
-        logger.error(f"下载 ETF 列表失败: {type(e).__name__}: {e}")
+        logger.error("下载 ETF 列表失败: %s: %s", type(e).__name__, e)
         # 如果有旧缓存，返回旧缓存
         if _etf_cache is not None:
             logger.warning("使用旧缓存")
@@ -78,6 +86,32 @@ def get_etf_list(force_refresh: bool = False) -> pd.DataFrame:
         return pd.DataFrame()
 
 
+# 代码 -> 名称索引，随 ETF 列表对象一起更新
+_etf_names: tuple = (None, {})
+# 搜索用的小写代码/名称数组，随 ETF 列表对象一起更新
+_etf_search_index: tuple = (None, None, None)
+
+
+def _etf_search_arrays(df: pd.DataFrame) -> tuple:
+    """(小写代码, 小写名称) 定长字符串数组，同一列表只构建一次"""
+    global _etf_search_index
+    if _etf_search_index[0] is not df:
+        codes = np.array(df["代码"].astype(str).str.lower().tolist(), dtype=str)
+        names = np.array(df["名称"].fillna("").astype(str).str.lower().tolist(), dtype=str)
+        _etf_search_index = (df, codes, names)
+    return _etf_search_index[1:]
+
+
+def _etf_name_index(df: pd.DataFrame) -> dict:
+    """ETF 列表的代码 -> 名称字典，同一列表只构建一次（重复代码取首条）"""
+    global _etf_names
+    if _etf_names[0] is not df:
+        codes = df["代码"].tolist()
+        names = df["名称"].tolist()
+        _etf_names = (df, dict(zip(reversed(codes), reversed(names))))
+    return _etf_names[1]
+
+
 def fetch_etf_info(code: str) -> dict:
     """
     获取 ETF 信息（从缓存查询，速度快）
@@ -87,14 +121,13 @@ def fetch_etf_info(code: str) -> dict:
         if df.empty:
             return {"code": code, "name": f"ETF-{code}", "found": False, "error": "无法获取ETF列表"}
         
-        row = df[df["代码"] == code]
-        if not row.empty:
-            name = row.iloc[0]["名称"]
+        name = _etf_name_index(df).get(code)
+        if name is not None:
             return {"code": code, "name": name, "found": True}
         else:
-            logger.warning(f"未找到 ETF {code}")
+            logger.warning("未找到 ETF %s", code)
     except Exception as e:
-        logger.error(f"获取 ETF {code} 信息失败: {type(e).__name__}: {e}")
+        logger.error("获取 ETF %s 信息失败: %s: %s", code, type(e).__name__, e)
     
     return {"code": code, "name": f"ETF-{code}", "found": False, "error": "未找到"}
 
@@ -111,33 +144,32 @@ def search_etf(keyword: str, limit: int = 20) -> list:
         if df.empty:
             return []
         
-        # 搜索代码或名称
-        keyword = keyword.strip()
-        mask = (
-            df["代码"].str.contains(keyword, case=False, na=False) | 
-            df["名称"].str.contains(keyword, na=False)
-        )
-        results = df[mask].head(limit)
+        # 搜索代码或名称：在预先转小写的数组上做子串查找（按字面匹配，不区分大小写）
+        keyword = keyword.strip().lower()
+        codes, names = _etf_search_arrays(df)
+        mask = (np.char.find(codes, keyword) >= 0) | (np.char.find(names, keyword) >= 0)
+        results = df.iloc[np.flatnonzero(mask)[:limit]]
         
         if results.empty:
             return []
         
-        result_list = []
-        for _, row in results.iterrows():
-            try:
-                result_list.append({
-                    "code": row["代码"],
-                    "name": row["名称"],
-                    "price": float(row["最新价"]) if pd.notna(row["最新价"]) else None,
-                    "change_pct": float(row["涨跌幅"]) if pd.notna(row["涨跌幅"]) else None,
-                })
-            except:
-                continue
-        
-        return result_list
+        # 各列一次转成 Python 列表后 zip 拼装；无法解析的数值记为 None
+        prices = pd.to_numeric(results["最新价"], errors="coerce").tolist()
+        changes = pd.to_numeric(results["涨跌幅"], errors="coerce").tolist()
+        return [
+            {
+                "code": code,
+                "name": name,
+                "price": None if math.isnan(price) else price,
+                "change_pct": None if math.isnan(change) else change,
+            }
+            for code, name, price, change in zip(
+                results["代码"].tolist(), results["名称"].tolist(), prices, changes
+            )
+        ]
         
     except Exception as e:
-        logger.error(f"搜索 ETF 失败: {type(e).__name__}: {e}")
+        logger.error("搜索 ETF 失败: %s: %s", type(e).__name__, e)
         return []
 
 
@@ -251,7 +283,7 @@ def get_all_assets() -> dict:
     """
     获取所有资产（带完整信息）
     """
-    config = load_config()
+    config = load_cached_config()
     return {
         "risk": config["assets"]["risk"],
         "defensive": config["assets"]["defensive"],
@@ -3,20 +3,52 @@ FastAPI 主应用 - 股债轮动系统 v0.1
 """
 from datetime import datetime
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+import anyio.to_thread
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+import json
 import logging
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
 import threading
 
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+
+    class AppJSONResponse(JSONResponse):
+        """orjson 序列化响应；允许非字符串键，NumPy 数组/标量直接编码"""
+        def render(self, content) -> bytes:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+except ImportError:  # 未安装 orjson 时使用标准库 json
+    AppJSONResponse = JSONResponse
+
 from data import load_config, get_asset_info, update_universe
+from auth import maintain_db
 
 # 路由模块
 from routers import auth, data, backtest, signal, trading, etf, admin
 
 
-logging.basicConfig(level=logging.INFO)
+LOG_DIR = Path(__file__).parent.parent / "logs"
+LOG_DIR.mkdir(exist_ok=True)
+
+# 控制台 + 滚动文件日志（单文件 10MB，保留 5 份）
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    handlers=[
+        logging.StreamHandler(),
+        RotatingFileHandler(LOG_DIR / "app.log", maxBytes=10 * 1024 * 1024, backupCount=5, encoding="utf-8"),
+    ],
+)
 logger = logging.getLogger(__name__)
 
+# 同步接口由 FastAPI 放入 anyio 线程池执行（默认上限 40），登录、留言等短小的 SQLite 请求
+# 并发较高时会在池外排队；线程各自持有 WAL 连接，读写互不阻塞，可放宽上限
+THREADPOOL_TOKENS = 100
+
 
 # ==================== 定时任务配置 ====================
 
@@ -26,9 +58,9 @@ def run_data_update():
     try:
         results = update_universe()
         success_count = sum(1 for r in results.values() if r.get("status") == "ok")
-        logger.info(f"✅ 数据更新完成: {success_count}/{len(results)} 个 ETF 更新成功")
+        logger.info("✅ 数据更新完成: %s/%s 个 ETF 更新成功", success_count, len(results))
     except Exception as e:
-        logger.error(f"❌ 数据更新失败: {e}")
+        logger.error("❌ 数据更新失败: %s", e)
 
 
 def start_scheduler():
@@ -50,11 +82,19 @@ def start_scheduler():
             name="每日数据更新",
             replace_existing=True
         )
+        # 每小时维护一次 users.db（刷新统计信息、合并 WAL）
+        scheduler.add_job(
+            maintain_db,
+            CronTrigger(minute=30, timezone=beijing_tz),
+            id="db_maintenance",
+            name="数据库维护",
+            replace_existing=True
+        )
         scheduler.start()
         logger.info("⏰ 定时任务已启动: 每天北京时间 18:00 自动更新数据")
         return scheduler
     except ImportError as e:
-        logger.warning(f"⚠️ 定时任务依赖未安装 ({e})，跳过定时任务")
+        logger.warning("⚠️ 定时任务依赖未安装 (%s)，跳过定时任务", e)
         return None
 
 
@@ -64,6 +104,8 @@ async def lifespan(app: FastAPI):
     # 启动时执行
     logger.info("🚀 股债轮动系统启动中...")
     
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_TOKENS
+    
     # 启动定时任务
     scheduler = start_scheduler()
     
@@ -83,7 +125,8 @@ async def lifespan(app: FastAPI):
 _cfg = load_config()
 APP_VERSION = _cfg.get("version", "0.1")
 
-app = FastAPI(title="股债轮动系统", version=APP_VERSION, lifespan=lifespan)
+# 全部接口默认用 orjson 序列化（图表、回测净值等大列表的编码开销明显低于标准库 json）
+app = FastAPI(title="股债轮动系统", version=APP_VERSION, lifespan=lifespan, default_response_class=AppJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -119,19 +162,37 @@ def health():
     return {"status": "ok", "time": datetime.now().isoformat(), "version": APP_VERSION}
 
 
+# 配置类接口的 JSON 响应体：load_config/get_asset_info 在配置文件未变时返回同一对象，
+# 按对象身份复用已序列化的字节，省去每次请求的 jsonable_encoder 遍历与 dumps
+_json_body_cache: dict = {}
+
+
+def _shared_json_response(key: str, obj) -> Response:
+    hit = _json_body_cache.get(key)
+    if hit is None or hit[0] is not obj:
+        body = json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        hit = _json_body_cache[key] = (obj, body)
+    return Response(content=hit[1], media_type="application/json")
+
+
 @app.get("/api/config")
 def get_config_api():
     """获取配置"""
-    return load_config()
+    return _shared_json_response("config", load_config())
 
 
 @app.get("/api/assets")
 def get_assets():
     """获取资产信息"""
-    return get_asset_info()
+    return _shared_json_response("assets", get_asset_info())
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000, reload=True)
+    # 开发入口（生产环境使用 scripts/start.sh）：reload 需要以导入字符串传入应用；
+    # 事件循环与 HTTP 解析显式使用 uvloop + httptools（uvicorn[standard] 已包含），连接数与监听队列与生产一致
+    uvicorn.run(
+        "main:app", host="0.0.0.0", port=8000, reload=True, loop="uvloop", http="httptools",
+        limit_concurrency=500, backlog=2048, timeout_keep_alive=30,
+    )
 
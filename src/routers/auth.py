@@ -1,20 +1,30 @@
 """
 认证相关路由 - /api/auth/*
 """
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
-import sqlite3
-from pathlib import Path
 
 from auth import (
     authenticate_user, create_access_token,
-    create_user, verify_password, hash_password
+    create_user, verify_password, update_password
 )
 from deps import require_user
 
 
 router = APIRouter(prefix="/api/auth", tags=["认证"])
 
+# scrypt 为 CPU 密集计算（hashlib 计算期间释放 GIL），放到按核数设定的独立线程池，
+# 登录高峰时不占用 FastAPI 处理其他同步接口的线程池
+_hash_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="password-hash")
+
+
+async def _run_hashing(func, *args):
+    """在密码哈希线程池中执行涉及哈希计算的函数"""
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, func, *args)
+
 
 class RegisterRequest(BaseModel):
     username: str
@@ -32,18 +42,18 @@ class ChangePasswordRequest(BaseModel):
 
 
 @router.post("/register")
-def api_register(req: RegisterRequest):
+async def api_register(req: RegisterRequest):
     """用户注册"""
-    success, msg = create_user(req.username, req.password)
+    success, msg = await _run_hashing(create_user, req.username, req.password)
     if not success:
         raise HTTPException(400, msg)
     return {"message": msg}
 
 
 @router.post("/login")
-def api_login(req: LoginRequest):
+async def api_login(req: LoginRequest):
     """用户登录"""
-    user, error_msg = authenticate_user(req.username, req.password)
+    user, error_msg = await _run_hashing(authenticate_user, req.username, req.password)
     if not user:
         raise HTTPException(401, error_msg)
     token = create_access_token({"sub": user["username"]})
@@ -71,22 +81,16 @@ def api_get_me(user: dict = Depends(require_user)):
 
 
 @router.post("/change-password")
-def api_change_password(req: ChangePasswordRequest, user: dict = Depends(require_user)):
+async def api_change_password(req: ChangePasswordRequest, user: dict = Depends(require_user)):
     """修改密码"""
     # 验证旧密码
-    if not verify_password(req.old_password, user["password_hash"]):
+    if not await _run_hashing(verify_password, req.old_password, user["password_hash"]):
         raise HTTPException(400, "当前密码错误")
     
     if len(req.new_password) < 6:
         raise HTTPException(400, "新密码至少6个字符")
     
     # 更新密码
-    db_path = Path(__file__).parent.parent / "data" / "users.db"
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    new_hash = hash_password(req.new_password)
-    c.execute("UPDATE users SET password_hash = ? WHERE id = ?", (new_hash, user["id"]))
-    conn.commit()
-    conn.close()
+    await _run_hashing(update_password, user["id"], req.new_password)
     
     return {"message": "密码修改成功"}
@@ -1,15 +1,15 @@
 """
 头像管理路由 - /api/avatar/*
 """
-import base64
 import hashlib
-from fastapi import APIRouter, HTTPException, Depends
+import json
+import string
+from fastapi import APIRouter, HTTPException, Depends, Response
 from pydantic import BaseModel
 from typing import Optional
-import sqlite3
 
 from deps import require_user
-from auth import DB_PATH
+from auth import get_conn
 
 
 router = APIRouter(prefix="/api/avatar", tags=["头像"])
@@ -40,6 +40,28 @@ DEFAULT_AVATARS = [
     {"id": "avatar_20", "url": "https://api.dicebear.com/7.x/pixel-art/svg?seed=Luna"},
 ]
 
+# 按 ID 索引，选择头像时直接查表
+_DEFAULT_AVATAR_MAP = {a["id"]: a for a in DEFAULT_AVATARS}
+# 标准 Base64 字符集（不含 = 填充）
+_BASE64_CHARS = (string.ascii_letters + string.digits + "+/").encode()
+
+
+def _is_base64(encoded: str) -> bool:
+    """
+    只校验 Base64 格式，不为此解码出整张图片：长度为 4 的倍数、末尾最多两个 =、其余均为合法字符
+    （bytes.translate 删除合法字符后应为空，整段在 C 层完成）
+    """
+    body = encoded.rstrip("=")
+    return (
+        len(encoded) % 4 == 0
+        and len(encoded) - len(body) <= 2
+        and body.isascii()
+        and not body.encode("ascii").translate(None, _BASE64_CHARS)
+    )
+
+# 默认头像列表固定不变，响应体在导入时序列化一次
+_DEFAULT_AVATARS_JSON = json.dumps({"avatars": DEFAULT_AVATARS}, separators=(",", ":")).encode("utf-8")
+
 
 class UploadAvatarRequest(BaseModel):
     avatar_data: str  # Base64 编码的图片数据 或 URL
@@ -49,32 +71,24 @@ class SelectAvatarRequest(BaseModel):
     avatar_id: str  # 默认头像ID
 
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
 def update_user_avatar(user_id: int, avatar_url: str) -> bool:
     """更新用户头像"""
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("UPDATE users SET avatar = ? WHERE id = ?", (avatar_url, user_id))
-    conn.commit()
-    conn.close()
+    conn = get_conn()
+    with conn:
+        conn.execute("UPDATE users SET avatar = ? WHERE id = ?", (avatar_url, user_id))
     return True
 
 
 @router.get("/defaults")
 def get_default_avatars():
     """获取默认头像列表"""
-    return {"avatars": DEFAULT_AVATARS}
+    return Response(content=_DEFAULT_AVATARS_JSON, media_type="application/json")
 
 
 @router.post("/select")
 def select_default_avatar(req: SelectAvatarRequest, user: dict = Depends(require_user)):
     """选择默认头像"""
-    avatar = next((a for a in DEFAULT_AVATARS if a["id"] == req.avatar_id), None)
+    avatar = _DEFAULT_AVATAR_MAP.get(req.avatar_id)
     if not avatar:
         raise HTTPException(400, "无效的头像ID")
     
@@ -101,11 +115,9 @@ def upload_avatar(req: UploadAvatarRequest, user: dict = Depends(require_user)):
         if len(avatar_data) > 700000:
             raise HTTPException(400, "头像图片过大，请选择小于 500KB 的图片")
         
-        # 验证 Base64 格式
-        try:
-            header, encoded = avatar_data.split(",", 1)
-            base64.b64decode(encoded)
-        except Exception:
+        # 验证 Base64 格式：长度为 4 的倍数且只含合法字符
+        header, sep, encoded = avatar_data.partition(",")
+        if not sep or not _is_base64(encoded):
             raise HTTPException(400, "无效的图片数据")
         
         update_user_avatar(user["id"], avatar_data)
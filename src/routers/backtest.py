@@ -7,7 +7,6 @@ from pydantic import BaseModel
 from typing import Optional
 
 from data import load_prices_monthly, load_config
-from strategy import run_backtest
 
 
 router = APIRouter(prefix="/api", tags=["回测"])
@@ -24,12 +23,23 @@ class BacktestRequest(BaseModel):
 @router.post("/backtest")
 def api_backtest(req: BacktestRequest):
     """运行回测"""
-    cfg = load_config()
-    cfg["strategy"]["risk_weight_on"] = req.risk_weight
-    cfg["strategy"]["risk_switch_ma"] = req.ma_period
-    cfg["strategy"]["momentum_months"] = req.momentum_months
+    # 策略模块会加载 numba 与编译内核，只在真正回测时导入，避免拖慢服务启动；
+    # 月频回测单次只需几毫秒，同步接口由线程池执行即可，交给进程池反而要多付序列化与跨进程往返的开销
+    from strategy import run_backtest
     
-    prices = load_prices_monthly()
+    # load_config 返回缓存的共享配置，覆盖参数时复制一份，不改动缓存
+    base = load_config()
+    cfg = {
+        **base,
+        "strategy": {
+            **base["strategy"],
+            "risk_weight_on": req.risk_weight,
+            "risk_switch_ma": req.ma_period,
+            "momentum_months": req.momentum_months,
+        },
+    }
+    
+    prices = load_prices_monthly(copy=False)  # 下面按日期筛选会生成新表，缓存本身不被修改
     if prices.empty:
         raise HTTPException(400, "无数据，请先更新")
     
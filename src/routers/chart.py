@@ -4,12 +4,23 @@
 from fastapi import APIRouter, HTTPException, Query
 from datetime import datetime, timedelta
 from typing import Optional
+import numpy as np
 import pandas as pd
 
 from data import get_etf_daily, get_all_symbols, get_asset_info
 
 router = APIRouter(prefix="/api/chart", tags=["图表"])
 
+# 图表周期对应的回看时长
+PERIOD_DELTAS = {
+    "1d": timedelta(days=1),
+    "1w": timedelta(weeks=1),
+    "1m": timedelta(days=30),
+    "1y": timedelta(days=365),
+    "3y": timedelta(days=365 * 3),
+    "5y": timedelta(days=365 * 5),
+}
+
 
 @router.get("/{code}")
 def get_chart_data(
@@ -32,28 +43,18 @@ def get_chart_data(
     if df.empty:
         raise HTTPException(404, f"暂无 {code} 的行情数据")
     
-    # 确保日期列格式正确
-    df["date"] = pd.to_datetime(df["date"])
-    df = df.sort_values("date")
+    # get_etf_daily 每次返回新表，可直接原地处理；缓存通常已是日期有序，只在乱序时排序
+    if not pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df["date"] = pd.to_datetime(df["date"])
+    if not df["date"].is_monotonic_increasing:
+        df = df.sort_values("date", kind="mergesort")
     
-    # 根据周期筛选数据
-    end_date = df["date"].max()
-    if period == "1d":
-        start_date = end_date - timedelta(days=1)
-    elif period == "1w":
-        start_date = end_date - timedelta(weeks=1)
-    elif period == "1m":
-        start_date = end_date - timedelta(days=30)
-    elif period == "1y":
-        start_date = end_date - timedelta(days=365)
-    elif period == "3y":
-        start_date = end_date - timedelta(days=365 * 3)
-    elif period == "5y":
-        start_date = end_date - timedelta(days=365 * 5)
-    else:  # all
-        start_date = df["date"].min()
+    # 根据周期筛选数据（all 或未知周期取全部）
+    delta = PERIOD_DELTAS.get(period)
+    start_date = df["date"].iloc[0] if delta is None else df["date"].iloc[-1] - delta
     
-    df_filtered = df[df["date"] >= start_date].copy()
+    # 日期有序，二分定位起点后切片即可
+    df_filtered = df.iloc[df["date"].searchsorted(start_date, side="left"):]
     
     if df_filtered.empty:
         raise HTTPException(404, "该时间段内无数据")
@@ -73,20 +74,17 @@ def get_chart_data(
     
     if chart_type == "kline":
         # K线图数据格式: [[date, open, close, low, high], ...]
+        # 整列取出为 Python 列表后按行拼装，不再逐行构造 Series
+        dates = df_filtered["date"].dt.strftime("%Y-%m-%d").tolist()
+        ohlc = [df_filtered[col].to_numpy(dtype=float).tolist() for col in ("open", "close", "low", "high")]
         result["data"] = [
-            [
-                row["date"].strftime("%Y-%m-%d"),
-                round(float(row["open"]), 3),
-                round(float(row["close"]), 3),
-                round(float(row["low"]), 3),
-                round(float(row["high"]), 3)
-            ]
-            for _, row in df_filtered.iterrows()
+            [d, round(o, 3), round(c, 3), round(lo, 3), round(hi, 3)]
+            for d, o, c, lo, hi in zip(dates, *ohlc)
         ]
     else:
         # 曲线图数据格式
-        result["dates"] = [d.strftime("%Y-%m-%d") for d in df_filtered["date"]]
-        result["prices"] = [round(float(p), 3) for p in df_filtered["close"]]
+        result["dates"] = df_filtered["date"].dt.strftime("%Y-%m-%d").tolist()
+        result["prices"] = np.round(df_filtered["close"].to_numpy(dtype=np.float64), 3).tolist()
     
     return result
 
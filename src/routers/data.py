@@ -3,7 +3,7 @@
 """
 from fastapi import APIRouter, BackgroundTasks
 
-from data import update_universe, get_data_status, get_last_update_time
+from data import update_universe, get_data_status, get_last_update_time, is_updating
 
 
 router = APIRouter(prefix="/api/data", tags=["数据"])
@@ -12,6 +12,8 @@ router = APIRouter(prefix="/api/data", tags=["数据"])
 @router.post("/update")
 def api_update_data(background_tasks: BackgroundTasks):
     """触发数据更新（后台任务）"""
+    if is_updating():
+        return {"status": "running"}
     background_tasks.add_task(update_universe)
     return {"status": "started"}
 
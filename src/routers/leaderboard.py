@@ -1,52 +1,58 @@
 """
 排行榜功能路由 - /api/leaderboard
 """
-from fastapi import APIRouter
-import sqlite3
-from pathlib import Path
+import hashlib
+import json
+import time
+from fastapi import APIRouter, Request, Response
 
-from auth import DB_PATH, _generate_default_avatar
-from trading import get_or_create_account, get_current_prices, calculate_portfolio_value
+from auth import get_conn, _generate_default_avatar
+from trading import get_current_prices, portfolio_totals
 
 
 router = APIRouter(prefix="/api/leaderboard", tags=["排行榜"])
 
 
+# 排行榜随行情/交易变化，不必每次请求都重算：序列化结果与 ETag 缓存 30 秒
+LEADERBOARD_TTL = 30
+_leaderboard_cache: tuple = (0.0, b"", "")  # (生成时间, 响应体, ETag)
+
+
 @router.get("")
-def api_get_leaderboard():
+def api_get_leaderboard(request: Request):
     """获取韭菜排行榜（收益率倒序 = 亏损最多在前）"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT id, username, avatar FROM users")
-    users = c.fetchall()
-    conn.close()
+    global _leaderboard_cache
+    created, body, etag = _leaderboard_cache
+    now = time.monotonic()
+    if not body or now - created >= LEADERBOARD_TTL:
+        body = json.dumps(_compute_leaderboard(), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        _leaderboard_cache = (now, body, etag)
+    
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={LEADERBOARD_TTL}"}
+    # 内容未变时只回 304，省去响应体传输
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _compute_leaderboard() -> list:
+    """计算排行榜"""
+    users = get_conn().execute("SELECT id, username, avatar FROM users").fetchall()
     
-    prices = get_current_prices()
+    # 所有账户一次批量估值，不再逐个用户构建完整持仓明细
+    totals = portfolio_totals([u[0] for u in users], get_current_prices())
     rankings = []
     
-    for user_id, username, avatar in users:
-        try:
-            account = get_or_create_account(user_id)
-            portfolio = calculate_portfolio_value(account, prices)
-            
-            rankings.append({
-                "user_id": user_id,
-                "username": username,
-                "avatar": avatar or _generate_default_avatar(username),
-                "total_value": portfolio["total_value"],
-                "total_pnl": portfolio["total_pnl"],
-                "total_pnl_pct": portfolio["total_pnl_pct"],
-            })
-        except Exception:
-            # 用户可能没有交易账户
-            rankings.append({
-                "user_id": user_id,
-                "username": username,
-                "avatar": avatar or _generate_default_avatar(username),
-                "total_value": 100000,
-                "total_pnl": 0,
-                "total_pnl_pct": 0,
-            })
+    for (user_id, username, avatar), (total_value, total_pnl, total_pnl_pct) in zip(users, totals):
+        rankings.append({
+            "user_id": user_id,
+            "username": username,
+            "avatar": avatar or _generate_default_avatar(username),
+            "total_value": total_value,
+            "total_pnl": total_pnl,
+            "total_pnl_pct": total_pnl_pct,
+        })
     
     # 按收益率倒序排序（亏损最多在前 = 韭菜排行榜）
     rankings.sort(key=lambda x: x["total_pnl_pct"])
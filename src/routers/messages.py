@@ -1,14 +1,13 @@
 """
 留言墙路由 - /api/messages/*
 """
-import sqlite3
 from datetime import datetime, timezone, timedelta
 from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
 from typing import Optional
 
 from deps import require_user
-from auth import DB_PATH
+from auth import get_conn
 
 # 北京时区 UTC+8
 CN_TZ = timezone(timedelta(hours=8))
@@ -26,10 +25,8 @@ class ReactionRequest(BaseModel):
 
 
 def get_db():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """获取数据库连接（复用当前线程的共享连接，不要关闭）"""
+    return get_conn()
 
 
 @router.get("")
@@ -40,60 +37,43 @@ def get_messages(page: int = 1, page_size: int = 20, user: dict = Depends(requir
     
     offset = (page - 1) * page_size
     
-    # 获取顶级留言（非回复）
+    # 获取顶级留言（非回复），当前用户的反应通过 LEFT JOIN 一并取出
     c.execute('''
         SELECT m.id, m.user_id, m.content, m.likes, m.dislikes, m.created_at, m.parent_id,
-               u.username, u.avatar
+               u.username, u.avatar, r.reaction_type AS user_reaction
         FROM messages m
         JOIN users u ON m.user_id = u.id
+        LEFT JOIN message_reactions r ON r.message_id = m.id AND r.user_id = ?
         WHERE m.parent_id IS NULL
         ORDER BY m.created_at DESC
         LIMIT ? OFFSET ?
-    ''', (page_size, offset))
+    ''', (user['id'], page_size, offset))
     
-    messages = []
-    for row in c.fetchall():
-        msg = dict(row)
-        
-        # 获取用户对该消息的反应
-        c.execute('''
-            SELECT reaction_type FROM message_reactions
-            WHERE message_id = ? AND user_id = ?
-        ''', (msg['id'], user['id']))
-        reaction_row = c.fetchone()
-        msg['user_reaction'] = reaction_row['reaction_type'] if reaction_row else None
-        
-        # 获取该消息的回复
-        c.execute('''
+    messages = [dict(row) for row in c.fetchall()]
+    replies_by_parent = {msg['id']: [] for msg in messages}
+    for msg in messages:
+        msg['replies'] = replies_by_parent[msg['id']]
+    
+    # 本页所有回复一次查出，再按 parent_id 分组（避免逐条留言/逐条回复查询）
+    if messages:
+        placeholders = ",".join("?" * len(messages))
+        c.execute(f'''
             SELECT m.id, m.user_id, m.content, m.likes, m.dislikes, m.created_at,
-                   u.username, u.avatar
+                   u.username, u.avatar, r.reaction_type AS user_reaction, m.parent_id
             FROM messages m
             JOIN users u ON m.user_id = u.id
-            WHERE m.parent_id = ?
+            LEFT JOIN message_reactions r ON r.message_id = m.id AND r.user_id = ?
+            WHERE m.parent_id IN ({placeholders})
             ORDER BY m.created_at ASC
-        ''', (msg['id'],))
-        
-        replies = []
+        ''', (user['id'], *replies_by_parent))
         for reply_row in c.fetchall():
             reply = dict(reply_row)
-            # 获取用户对回复的反应
-            c.execute('''
-                SELECT reaction_type FROM message_reactions
-                WHERE message_id = ? AND user_id = ?
-            ''', (reply['id'], user['id']))
-            reply_reaction = c.fetchone()
-            reply['user_reaction'] = reply_reaction['reaction_type'] if reply_reaction else None
-            replies.append(reply)
-        
-        msg['replies'] = replies
-        messages.append(msg)
+            replies_by_parent[reply.pop('parent_id')].append(reply)
     
     # 获取总数
     c.execute('SELECT COUNT(*) FROM messages WHERE parent_id IS NULL')
     total = c.fetchone()[0]
     
-    conn.close()
-    
     return {
         'messages': messages,
         'page': page,
@@ -118,7 +98,6 @@ def create_message(req: CreateMessageRequest, user: dict = Depends(require_user)
     if req.parent_id:
         c.execute('SELECT id FROM messages WHERE id = ?', (req.parent_id,))
         if not c.fetchone():
-            conn.close()
             raise HTTPException(404, "要回复的留言不存在")
     
     c.execute('''
@@ -128,7 +107,6 @@ def create_message(req: CreateMessageRequest, user: dict = Depends(require_user)
     
     message_id = c.lastrowid
     conn.commit()
-    conn.close()
     
     return {'message': '发布成功', 'id': message_id}
 
@@ -142,74 +120,42 @@ def react_to_message(message_id: int, req: ReactionRequest, user: dict = Depends
     conn = get_db()
     c = conn.cursor()
     
-    # 检查留言是否存在
-    c.execute('SELECT id, likes, dislikes FROM messages WHERE id = ?', (message_id,))
+    # 留言是否存在与用户已有反应一次查出
+    c.execute('''
+        SELECT m.id, r.reaction_type
+        FROM messages m
+        LEFT JOIN message_reactions r ON r.message_id = m.id AND r.user_id = ?
+        WHERE m.id = ?
+    ''', (user['id'], message_id))
     msg = c.fetchone()
     if not msg:
-        conn.close()
         raise HTTPException(404, "留言不存在")
     
-    # 检查用户是否已有反应
-    c.execute('''
-        SELECT reaction_type FROM message_reactions
-        WHERE message_id = ? AND user_id = ?
-    ''', (message_id, user['id']))
-    existing = c.fetchone()
-    
-    likes = msg['likes']
-    dislikes = msg['dislikes']
-    new_reaction = None
-    
-    if existing:
-        old_type = existing['reaction_type']
-        # 删除旧的反应
-        c.execute('''
-            DELETE FROM message_reactions WHERE message_id = ? AND user_id = ?
-        ''', (message_id, user['id']))
-        
-        # 更新计数
-        if old_type == 'like':
-            likes -= 1
+    # 点赞/踩计数由 message_reactions 上的触发器维护，这里只写反应记录
+    with conn:
+        if msg['reaction_type'] == req.reaction_type:
+            # 再次点击同一类型：取消
+            c.execute('''
+                DELETE FROM message_reactions WHERE message_id = ? AND user_id = ?
+            ''', (message_id, user['id']))
+            new_reaction = None
         else:
-            dislikes -= 1
-        
-        # 如果点击的是不同类型，添加新反应
-        if old_type != req.reaction_type:
+            # 新增反应，或从赞改为踩（反之亦然）
             c.execute('''
                 INSERT INTO message_reactions (message_id, user_id, reaction_type, created_at)
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT(message_id, user_id) DO UPDATE
+                SET reaction_type = excluded.reaction_type, created_at = excluded.created_at
             ''', (message_id, user['id'], req.reaction_type, datetime.now(CN_TZ).isoformat()))
-            
-            if req.reaction_type == 'like':
-                likes += 1
-            else:
-                dislikes += 1
             new_reaction = req.reaction_type
-    else:
-        # 添加新反应
-        c.execute('''
-            INSERT INTO message_reactions (message_id, user_id, reaction_type, created_at)
-            VALUES (?, ?, ?, ?)
-        ''', (message_id, user['id'], req.reaction_type, datetime.now(CN_TZ).isoformat()))
         
-        if req.reaction_type == 'like':
-            likes += 1
-        else:
-            dislikes += 1
-        new_reaction = req.reaction_type
-    
-    # 更新留言的点赞/踩计数
-    c.execute('''
-        UPDATE messages SET likes = ?, dislikes = ? WHERE id = ?
-    ''', (likes, dislikes, message_id))
-    
-    conn.commit()
-    conn.close()
+        c.execute('SELECT likes, dislikes FROM messages WHERE id = ?', (message_id,))
+        counts = c.fetchone()
     
     return {
         'message': '操作成功',
-        'likes': likes,
-        'dislikes': dislikes,
+        'likes': counts['likes'],
+        'dislikes': counts['dislikes'],
         'user_reaction': new_reaction
     }
 
@@ -220,23 +166,21 @@ def delete_message(message_id: int, user: dict = Depends(require_user)):
     conn = get_db()
     c = conn.cursor()
     
-    c.execute('SELECT user_id FROM messages WHERE id = ?', (message_id,))
-    msg = c.fetchone()
+    # 留言本身与其回复一次查出：既用于权限校验，也得到需要级联删除的全部 ID
+    c.execute('SELECT id, user_id FROM messages WHERE id = ? OR parent_id = ?', (message_id, message_id))
+    rows = c.fetchall()
+    msg = next((r for r in rows if r['id'] == message_id), None)
     
     if not msg:
-        conn.close()
         raise HTTPException(404, "留言不存在")
     
     if msg['user_id'] != user['id'] and not user.get('is_admin'):
-        conn.close()
         raise HTTPException(403, "无权删除此留言")
     
-    # 删除相关反应
-    c.execute('DELETE FROM message_reactions WHERE message_id = ?', (message_id,))
-    # 删除留言（包括回复）
-    c.execute('DELETE FROM messages WHERE id = ? OR parent_id = ?', (message_id, message_id))
-    
-    conn.commit()
-    conn.close()
+    # 同一事务内先删留言再删其（含回复的）反应，反应删除触发的计数更新不再命中已删除的留言
+    ids = [(r['id'],) for r in rows]
+    with conn:
+        c.executemany('DELETE FROM messages WHERE id = ?', ids)
+        c.executemany('DELETE FROM message_reactions WHERE message_id = ?', ids)
     
     return {'message': '删除成功'}
@@ -2,25 +2,72 @@
 策略信号相关路由 - /api/signal
 """
 from fastapi import APIRouter
+import numpy as np
+import pandas as pd
 
-from data import load_prices_monthly, load_config, get_asset_info
+from data import load_prices_monthly, load_config
 
 
 router = APIRouter(prefix="/api", tags=["策略信号"])
 
 
+def _momentum_pct(prices: pd.DataFrame, codes: list, months: int) -> np.ndarray:
+    """
+    一次性计算各标的近 N 月动量(%)，与逐列 dropna 后取 iloc[-(N+1)] / iloc[-1] 口径一致
+    数据不足或不在价格表中的标的动量记为 0
+    """
+    result = np.zeros(len(codes))
+    present = [i for i, c in enumerate(codes) if c in prices.columns]
+    if not present:
+        return result
+    
+    mat = prices[[codes[i] for i in present]].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(mat)
+    n_valid = valid.sum(axis=0)
+    # 每列有效值的行号依次排在前面
+    valid_rows = np.argsort(~valid, axis=0, kind="stable")
+    ok = n_valid >= months + 1
+    cols = np.flatnonzero(ok)
+    end_p = mat[valid_rows[n_valid[cols] - 1, cols], cols]
+    start_p = mat[valid_rows[n_valid[cols] - months - 1, cols], cols]
+    result[np.asarray(present)[cols]] = np.round((end_p / start_p - 1) * 100, 2)
+    return result
+
+
+# 信号只取决于配置与月频价格表，二者在文件未变时都是同一个缓存对象，按对象身份复用上一次的结果
+_signal_cache: tuple = (None, None, None)
+
+
 @router.get("/signal")
 def api_get_signal():
     """获取当前月度信号"""
+    global _signal_cache
     cfg = load_config()
-    asset_info = get_asset_info()
-    prices = load_prices_monthly()
+    prices = load_prices_monthly(copy=False)  # 只读
+    
+    cached_cfg, cached_prices, result = _signal_cache
+    if cached_cfg is cfg and cached_prices is prices:
+        return result
+    result = _compute_signal(cfg, prices)
+    _signal_cache = (cfg, prices, result)
+    return result
+
+
+def _compute_signal(cfg: dict, prices: pd.DataFrame) -> dict:
+    """根据配置与月频价格计算信号（结果会被缓存复用，不要原地修改）"""
+    # 配置项只取一次
+    strategy_cfg = cfg["strategy"]
+    ma_period = strategy_cfg["risk_switch_ma"]
+    months = strategy_cfg["momentum_months"]
+    risk_w = strategy_cfg["risk_weight_on"]
+    risk_cfg = cfg["assets"]["risk"]
+    defensive_cfg = cfg["assets"]["defensive"]
+    benchmark_cfg = cfg["assets"]["benchmark"]
     
-    if prices.empty or len(prices) < cfg["strategy"]["risk_switch_ma"] + 1:
+    if prices.empty or len(prices) < ma_period + 1:
         return {"error": "数据不足"}
     
-    benchmark = cfg["assets"]["benchmark"]["code"]
-    ma_period = cfg["strategy"]["risk_switch_ma"]
+    benchmark = benchmark_cfg["code"]
     
     if benchmark in prices.columns:
         bench_prices = prices[benchmark].dropna()
@@ -34,32 +81,22 @@ def api_get_signal():
         current = 0.0
         raw_ratio = 0.0
     
-    # 计算动量
-    risk_assets = []
-    for asset in cfg["assets"]["risk"]:
-        code = asset["code"]
-        momentum = 0.0
-        if code in prices.columns:
-            series = prices[code].dropna()
-            if len(series) >= cfg["strategy"]["momentum_months"] + 1:
-                months = cfg["strategy"]["momentum_months"]
-                start_p = float(series.iloc[-(months + 1)])
-                end_p = float(series.iloc[-1])
-                momentum = round((end_p / start_p - 1) * 100, 2)
-        risk_assets.append({
-            "code": code,
-            "name": asset.get("name", code),
-            "momentum": momentum
-        })
+    # 计算动量（所有风险资产一次算完）
+    momentums = _momentum_pct(prices, [a["code"] for a in risk_cfg], months)
     
-    # 排序风险资产
-    risk_assets.sort(key=lambda x: x["momentum"], reverse=True)
+    # 按动量降序排列风险资产：在数组上 argsort，不再逐元素回调 key 函数；
+    # stable 保证同值时保持配置顺序，与 list.sort(reverse=True) 一致
+    order = np.argsort(-momentums, kind="stable")
+    risk_assets = [
+        {"code": risk_cfg[i]["code"], "name": risk_cfg[i].get("name", risk_cfg[i]["code"]),
+         "momentum": float(momentums[i])}
+        for i in order.tolist()
+    ]
     
     # 推荐持仓
     recommendation = []
     if risk_on:
         top_risk = risk_assets[0]
-        risk_w = cfg["strategy"]["risk_weight_on"]
         
         recommendation.append({
             "code": top_risk["code"],
@@ -67,25 +104,20 @@ def api_get_signal():
             "weight": round((1.0 - risk_w) * 100, 1),
             "type": "risk"
         })
-        
-        for da in cfg["assets"]["defensive"]:
-           recommendation.append({
-               "code": da["code"],
-               "name": da.get("name", da["code"]),
-               "weight": round(da["weight"] * risk_w * 100, 1),
-               "type": "defensive"
-           })
-    else:
-        for da in cfg["assets"]["defensive"]:
-           recommendation.append({
-               "code": da["code"],
-               "name": da.get("name", da["code"]),
-               "weight": round(da["weight"] * 100, 1),
-               "type": "defensive"
-           })
+    
+    # 防御资产权重整列缩放：进攻模式按 risk_w 缩放，防御模式满配
+    def_weights = np.array([da["weight"] for da in defensive_cfg], dtype=np.float64)
+    def_weights = def_weights * risk_w * 100 if risk_on else def_weights * 100
+    for da, w in zip(defensive_cfg, def_weights.tolist()):
+        recommendation.append({
+            "code": da["code"],
+            "name": da.get("name", da["code"]),
+            "weight": round(w, 1),
+            "type": "defensive"
+        })
     
     # 生成策略解释
-    bench_name = next((a["name"] for a in cfg["assets"]["risk"] + [cfg["assets"]["benchmark"]] if a["code"] == benchmark), benchmark)
+    bench_name = next((a["name"] for a in risk_cfg + [benchmark_cfg] if a["code"] == benchmark), benchmark)
     top_name = risk_assets[0]["name"] if risk_assets else "未知"
     
     if risk_on:
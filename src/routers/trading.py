@@ -1,20 +1,43 @@
 """
 交易相关路由 - /api/trading/*
 """
-from fastapi import APIRouter, HTTPException, Depends
+import asyncio
+import hashlib
+import json
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional
+from bisect import bisect_right
+import numpy as np
 
+from data import load_config
 from deps import require_user
 from trading import (
-    get_or_create_account, buy, sell, reset_account as reset_trading_account,
-    calculate_portfolio_value, get_current_prices, get_transactions, get_nav_history
+    get_or_create_account, buy, sell, execute_batch, reset_account as reset_trading_account,
+    calculate_portfolio_value, get_current_prices, get_transactions, get_nav_history,
+    recent_trade_times, NAV_HISTORY_DAYS
 )
 from routers.signal import api_get_signal
 
 
 router = APIRouter(prefix="/api/trading", tags=["交易"])
 
+# 偏离度分级阈值 (%)：<5 为 low，<15 为 medium，其余为 high
+DEVIATION_BOUNDS = (5, 15)
+DEVIATION_LEVELS = ("low", "medium", "high")
+
+# 默认调仓阈值 (%)：整体偏离低于该值时建议维持现状，可由 config.json 的 paper.rebalance_threshold 覆盖
+REBALANCE_THRESHOLD = 5
+
+# 检测到手动交易时，各偏离等级对应的建议模式与提示
+MANUAL_SUGGESTIONS = {
+    "low": ("manual_detected_ok", "检测到您近期有手动交易，当前持仓与策略偏离较小，无需调整。"),
+    "medium": ("manual_detected_wait", "检测到您近期有手动交易，当前持仓与策略有一定偏离。建议等待下一调仓周期或点击「刷新建议」重新计算。"),
+    "high": ("manual_detected_review", "检测到您近期有手动交易，当前持仓与策略偏离较大。如需调整，请点击「刷新建议」查看最新建议。"),
+}
+
 
 class BuyRequest(BaseModel):
     symbol: str
@@ -40,6 +63,7 @@ class TradeAction(BaseModel):
 
 class BatchTradeRequest(BaseModel):
     actions: list[TradeAction]
+    strict: bool = False  # 任一笔无法成交时整批拒绝（400），不写入任何交易
 
 
 @router.get("/account")
@@ -75,15 +99,23 @@ def api_sell(req: SellRequest, user: dict = Depends(require_user)):
 
 
 @router.get("/transactions")
-def api_get_transactions(user: dict = Depends(require_user)):
-    """获取交易记录"""
-    return get_transactions(user["id"])
+def api_get_transactions(
+    user: dict = Depends(require_user),
+    limit: int = Query(20, ge=1, le=200, description="每页条数"),
+    cursor: Optional[int] = Query(None, description="上一页最后一条记录的 id"),
+):
+    """获取交易记录（按时间倒序分页）"""
+    return get_transactions(user["id"], limit, cursor)
 
 
 @router.get("/history")
-def api_get_nav_history(user: dict = Depends(require_user)):
+def api_get_nav_history(
+    user: dict = Depends(require_user),
+    limit: Optional[int] = Query(None, ge=1, le=NAV_HISTORY_DAYS, description="只取最近的条数，默认全部"),
+    cursor: Optional[str] = Query(None, description="只返回该日期之前的记录，YYYY-MM-DD"),
+):
     """获取用户净值历史"""
-    return get_nav_history(user["id"])
+    return get_nav_history(user["id"], limit, cursor)
 
 
 @router.post("/reset")
@@ -95,101 +127,93 @@ def api_reset_my_account(user: dict = Depends(require_user)):
     return {"message": "账户已重置"}
 
 
+def _advice_etag(*parts) -> str:
+    """由交易建议的全部输入生成 ETag（输入不变则建议不变）"""
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return f'"{hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()}"'
+
+
 @router.get("/advice")
-def api_get_trading_advice(user: dict = Depends(require_user), force_refresh: bool = False):
+async def api_get_trading_advice(
+    request: Request, response: Response, user: dict = Depends(require_user), force_refresh: bool = False
+):
     """获取针对当前用户账户的具体交易建议（支持用户干预检测）"""
     from datetime import datetime, timedelta
     
-    signal = api_get_signal()
+    # 检查最近10笔交易中24小时内的成交（可能是手动操作），直接比较 ISO 时间字符串，无需逐条解析
+    since = (datetime.now() - timedelta(hours=24)).isoformat()
+    
+    # 信号、账户、价格与最近交易互不依赖，各自在线程池中并发读取，不阻塞事件循环
+    signal, account, prices, recent_times = await asyncio.gather(
+        run_in_threadpool(api_get_signal),
+        run_in_threadpool(get_or_create_account, user["id"]),
+        run_in_threadpool(get_current_prices),
+        run_in_threadpool(recent_trade_times, user["id"], since, 10),
+    )
     if "error" in signal:
         return {"error": signal["error"]}
     
-    account = get_or_create_account(user["id"])
-    prices = get_current_prices()
+    # ========== 用户干预检测 ==========
+    # 最早的一笔近期交易时间；如果最近有交易且未强制刷新，标记为用户干预
+    last_trade_time = recent_times[0] if recent_times else None
+    user_intervention_detected = bool(recent_times) and not force_refresh
+    
+    # 信号、持仓、价格、干预状态与阈值都未变化时，客户端缓存的建议仍然有效，直接回 304
+    threshold = load_config().get("paper", {}).get("rebalance_threshold", REBALANCE_THRESHOLD)
+    etag = _advice_etag(
+        user["id"], signal["date"], signal["risk_on"], signal["recommendation"],
+        account["cash"], account["positions"], prices,
+        user_intervention_detected, last_trade_time, force_refresh, threshold,
+    )
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    
     portfolio = calculate_portfolio_value(account, prices)
     
     total_value = portfolio["total_value"]
     current_positions = {p["symbol"]: p for p in portfolio.get("positions", [])}
     
-    # ========== 用户干预检测 ==========
-    transactions = account.get("transactions", [])
-    user_intervention_detected = False
-    last_trade_time = None
-    recent_manual_trades = []
-    
-    # 检查最近24小时内的交易（可能是手动操作）
-    now = datetime.now()
-    for tx in reversed(transactions[-10:]):  # 检查最近10笔交易
-        tx_time_str = tx.get("time", "")
-        if tx_time_str:
-            try:
-                tx_time = datetime.fromisoformat(tx_time_str)
-                if now - tx_time < timedelta(hours=24):
-                    last_trade_time = tx_time_str
-                    recent_manual_trades.append(tx)
-            except:
-                pass
-    
-    # 如果最近有交易，标记为用户干预
-    if recent_manual_trades and not force_refresh:
-        user_intervention_detected = True
-    
     # ========== 计算目标持仓 ==========
+    # 价格/权重一次取成数组，目标市值、股数与偏离度整体向量计算
+    recs = [rec for rec in signal["recommendation"] if rec["code"] in prices]
+    codes = [rec["code"] for rec in recs]
+    px = np.array([prices[code]["price"] for code in codes], dtype=np.float64)
+    target_values = total_value * (np.array([rec["weight"] for rec in recs], dtype=np.float64) / 100)
+    target_shares = (np.floor(target_values / px / 100) * 100).astype(np.int64)  # 按100股整数
+    
     target_positions = {}
-    for rec in signal["recommendation"]:
-        code = rec["code"]
-        target_weight = rec["weight"] / 100
-        target_value = total_value * target_weight
-        
-        if code in prices:
-            price = prices[code]["price"]
-            target_shares = int(target_value / price / 100) * 100
-            target_positions[code] = {
-                "code": code,
-                "name": rec["name"],
-                "target_weight": rec["weight"],
-                "target_value": round(target_value, 2),
-                "target_shares": target_shares,
-                "price": price,
-            }
+    for i, rec in enumerate(recs):
+        target_positions[codes[i]] = {
+            "code": codes[i],
+            "name": rec["name"],
+            "target_weight": rec["weight"],
+            "target_value": round(float(target_values[i]), 2),
+            "target_shares": int(target_shares[i]),
+            "price": prices[codes[i]]["price"],
+        }
     
     # ========== 计算偏离度 ==========
-    total_deviation = 0
-    for code, target in target_positions.items():
-        current = current_positions.get(code)
-        current_value = current["value"] if current else 0
-        deviation = abs(current_value - target["target_value"])
-        total_deviation += deviation
+    held = [c in current_positions for c in target_positions]
+    target_arr = np.array([t["target_value"] for t in target_positions.values()], dtype=np.float64)
+    current_arr = np.array([current_positions[c]["value"] if h else 0.0 for c, h in zip(target_positions, held)], dtype=np.float64)
+    total_deviation = float(np.abs(current_arr - target_arr).sum())
     
     # 多余持仓的偏离
-    for symbol, pos in current_positions.items():
-        if symbol not in target_positions:
-            total_deviation += pos["value"]
+    total_deviation += sum(pos["value"] for symbol, pos in current_positions.items() if symbol not in target_positions)
     
     deviation_pct = (total_deviation / total_value * 100) if total_value > 0 else 0
     
-    # 偏离度等级
-    if deviation_pct < 5:
-        deviation_level = "low"
-    elif deviation_pct < 15:
-        deviation_level = "medium"
-    else:
-        deviation_level = "high"
+    # 偏离度等级：按阈值查表
+    deviation_level = DEVIATION_LEVELS[bisect_right(DEVIATION_BOUNDS, deviation_pct)]
     
     # ========== 智能建议策略 ==========
     suggestion_mode = "auto"  # 默认自动模式
     suggestion_message = None
     
     if user_intervention_detected and not force_refresh:
-        if deviation_level == "low":
-            suggestion_mode = "manual_detected_ok"
-            suggestion_message = "检测到您近期有手动交易，当前持仓与策略偏离较小，无需调整。"
-        elif deviation_level == "medium":
-            suggestion_mode = "manual_detected_wait"
-            suggestion_message = "检测到您近期有手动交易，当前持仓与策略有一定偏离。建议等待下一调仓周期或点击「刷新建议」重新计算。"
-        else:
-            suggestion_mode = "manual_detected_review"
-            suggestion_message = "检测到您近期有手动交易，当前持仓与策略偏离较大。如需调整，请点击「刷新建议」查看最新建议。"
+        suggestion_mode, suggestion_message = MANUAL_SUGGESTIONS[deviation_level]
     
     # ========== 生成具体建议 ==========
     actions = []
@@ -204,6 +228,16 @@ def api_get_trading_advice(user: dict = Depends(require_user), force_refresh: bo
             "shares": 0,
             "reason": f"偏离度 {deviation_pct:.1f}%（{deviation_level}）"
         })
+    elif deviation_pct < threshold and not force_refresh:
+        # 整体偏离低于调仓阈值：不逐标的计算调整股数，直接维持现状
+        actions.append({
+            "action": "hold",
+            "action_text": "持有",
+            "code": "-",
+            "name": "当前持仓符合策略",
+            "shares": 0,
+            "reason": f"偏离度 {deviation_pct:.1f}% 低于调仓阈值 {threshold}%"
+        })
     else:
         # 1. 卖出不在目标中的持仓
         for symbol, pos in current_positions.items():
@@ -218,12 +252,14 @@ def api_get_trading_advice(user: dict = Depends(require_user), force_refresh: bo
                     "reason": "不在目标持仓中"
                 })
         
+        # 各目标标的需调整的股数一次算出（未持有的按 0 股计）
+        current_shares = np.array([current_positions[c]["shares"] if h else 0 for c, h in zip(target_positions, held)], dtype=np.int64)
+        target_share_arr = np.array([t["target_shares"] for t in target_positions.values()], dtype=np.int64)
+        diff_shares_list = (target_share_arr - current_shares).tolist()
+        
         # 2. 调整现有持仓或新建持仓
-        for code, target in target_positions.items():
-            current = current_positions.get(code)
-            
-            if current:
-                diff_shares = target["target_shares"] - current["shares"]
+        for (code, target), is_held, diff_shares in zip(target_positions.items(), held, diff_shares_list):
+            if is_held:
                 if diff_shares > 0:
                     actions.append({
                         "action": "buy",
@@ -245,14 +281,14 @@ def api_get_trading_advice(user: dict = Depends(require_user), force_refresh: bo
                         "reason": f"目标 {target['target_weight']}%，需减仓"
                     })
             else:
-                if target["target_shares"] > 0:
+                if diff_shares > 0:
                     actions.append({
                         "action": "buy",
                         "action_text": "买入",
                         "code": code,
                         "name": target["name"],
-                        "shares": target["target_shares"],
-                        "amount": round(target["target_shares"] * target["price"], 2),
+                        "shares": diff_shares,
+                        "amount": round(diff_shares * target["price"], 2),
                         "reason": f"目标 {target['target_weight']}%，新建仓"
                     })
         
@@ -286,26 +322,12 @@ def api_get_trading_advice(user: dict = Depends(require_user), force_refresh: bo
 
 @router.post("/batch")
 def api_batch_trade(req: BatchTradeRequest, user: dict = Depends(require_user)):
-    """批量执行交易"""
-    results = []
-    
-    sells = [a for a in req.actions if a.action == 'sell']
-    buys = [a for a in req.actions if a.action == 'buy']
-    
-    for action in sells:
-        symbol = action.effective_symbol
-        try:
-            success, msg = sell(user["id"], symbol, action.shares)
-            results.append({"symbol": symbol, "action": "sell", "success": success, "message": msg})
-        except Exception as e:
-            results.append({"symbol": symbol, "action": "sell", "success": False, "message": str(e)})
-            
-    for action in buys:
-        symbol = action.effective_symbol
-        try:
-            success, msg = buy(user["id"], symbol, action.amount)
-            results.append({"symbol": symbol, "action": "buy", "success": success, "message": msg})
-        except Exception as e:
-            results.append({"symbol": symbol, "action": "buy", "success": False, "message": str(e)})
-
+    """批量执行交易（先卖后买，在内存中逐笔试算后一个事务内提交）"""
+    sells = [("sell", a.effective_symbol, a.shares) for a in req.actions if a.action == 'sell']
+    buys = [("buy", a.effective_symbol, a.amount) for a in req.actions if a.action == 'buy']
+    results = execute_batch(user["id"], sells + buys, strict=req.strict)
+    if req.strict:
+        failed = [f"{r['symbol']}：{r['message']}" for r in results if not r["success"]]
+        if failed:
+            raise HTTPException(400, "批量交易未执行：" + "；".join(failed))
     return {"results": results}
@@ -1,127 +1,147 @@
 """
-股债轮动策略 - 使用 BT 库实现
+股债轮动策略 - 信号整表向量化计算，逐月调仓由 numba 内核撮合（整数股口径与 bt 库一致）
 """
-import bt
+import math
+
 import pandas as pd
 import numpy as np
-from pathlib import Path
-import json
 
-# 加载配置
-CONFIG_PATH = Path(__file__).parent.parent / "config.json"
-def load_config() -> dict:
-    return json.loads(CONFIG_PATH.read_text())
+# 配置读取与 data 模块共用按修改时间缓存的同一份（只读）
+from data import load_config, get_asset_info
+# numba 可选，未安装时 njit 退化为原函数
+from backtest import njit
+
+
+# 代码 -> 名称映射，随 data 模块的资产信息缓存失效
+_asset_map_cache: tuple = (None, None)
 
 
 def get_asset_map() -> dict:
-    """返回 {代码: 名称} 映射"""
-    cfg = load_config()
-    m = {}
-    for a in cfg["assets"]["risk"]:
-        m[a["code"]] = a["name"]
-    for a in cfg["assets"]["defensive"]:
-        m[a["code"]] = a["name"]
-    return m
+    """返回 {代码: 名称} 映射；配置未重新加载时复用同一份，调用方不要原地修改"""
+    global _asset_map_cache
+    info = get_asset_info()
+    if _asset_map_cache[0] is not info:
+        _asset_map_cache = (info, {code: a["name"] for code, a in info.items()})
+    return _asset_map_cache[1]
 
 
-class SetWeights(bt.Algo):
+def risk_switch_series(close: pd.Series, ma_period: int = 10) -> np.ndarray:
     """
-    自定义权重设置算法：从 target.temp["weights"] 读取权重并设置
-    这是 BT 库的标准模式
+    风险开关：每个 bar 温度计ETF是否在N月均线之上
+    回测沿用 bt 的约定在数据前补一行空值，首个满窗 bar 只有 N-1 个有效值
     """
-    def __call__(self, target):
-        weights = target.temp.get("weights", {})
-        if weights:
-            target.temp["weights"] = pd.Series(weights)
-        return True
-
-
-class RiskSwitch(bt.Algo):
-    """风险开关：检查温度计ETF是否在N月均线之上"""
-    def __init__(self, benchmark: str, ma_period: int = 10):
-        super().__init__()
-        self.benchmark = benchmark
-        self.ma_period = ma_period
-    
-    def __call__(self, target):
-        if self.benchmark not in target.universe:
-            target.temp["risk_on"] = False
-            return True
-        
-        prices = target.universe[self.benchmark]
-        if len(prices) < self.ma_period:
-            target.temp["risk_on"] = False
-            return True
-        
-        ma = prices.iloc[-self.ma_period:].mean()
-        current = prices.iloc[-1]
-        target.temp["risk_on"] = current > ma
-        return True
-
-
-class SelectByMomentum(bt.Algo):
-    """动量选股：从风险资产中选择过去N月回报最高的"""
-    def __init__(self, risk_assets: list, lookback: int = 6):
-        super().__init__()
-        self.risk_assets = risk_assets
-        self.lookback = lookback
-    
-    def __call__(self, target):
-        if not target.temp.get("risk_on", False):
-            target.temp["selected"] = []
-            return True
-        
-        scores = {}
-        for sym in self.risk_assets:
-            if sym not in target.universe:
-                continue
-            prices = target.universe[sym]
-            if len(prices) < self.lookback + 1:
-                continue
-            ret = prices.iloc[-1] / prices.iloc[-self.lookback - 1] - 1
-            scores[sym] = ret
-        
-        if not scores:
-            target.temp["selected"] = []
-            return True
-        
-        best = max(scores, key=scores.get)
-        target.temp["selected"] = [best]
-        return True
+    ma = close.rolling(ma_period, min_periods=max(ma_period - 1, 1)).mean()
+    return (close > ma).to_numpy()
 
 
-class WeighRiskDefensive(bt.Algo):
-    """根据风险开关设置权重，并写入 target.temp['weights']"""
-    def __init__(self, risk_weight: float, defensive_assets: list, defensive_weights: list):
-        super().__init__()
-        self.risk_weight = risk_weight
-        self.defensive_assets = defensive_assets
-        self.defensive_weights = defensive_weights
+def momentum_winners(prices: pd.DataFrame, risk_assets: list, lookback: int = 6) -> np.ndarray:
+    """
+    动量选股：每个 bar 回看 lookback 期收益最高的风险资产在 prices 中的列号（无可比收益时为 -1）
+    前补的空行使前 lookback 个 bar 没有起点价格，与 shift(lookback) 留下的空值一致；
+    其中第 lookback-1 个 bar 的起点正是补的空行，收益全为 NaN，原逐 bar 实现的
+    max(scores, key=scores.get) 在全 NaN 时取第一个风险资产，这里保持一致
+    """
+    cols = prices.columns.get_indexer(risk_assets)
+    cols = cols[cols >= 0]
+    if len(cols) == 0:
+        return np.full(len(prices), -1, dtype=np.int64)
+    closes = prices.to_numpy(dtype=np.float64)[:, cols]
+    start = np.full_like(closes, np.nan)
+    start[lookback:] = closes[:-lookback] if lookback > 0 else closes
+    rets = closes / start - 1
+    valid = ~np.isnan(rets)
+    # 无效收益按 -inf 参与比较，argmax 取同值中列序最前的一个
+    best = np.argmax(np.where(valid, rets, -np.inf), axis=1)
+    winners = np.where(valid.any(axis=1), cols[best], -1).astype(np.int64)
+    if 0 < lookback <= len(prices):
+        winners[lookback - 1] = cols[0]
+    return winners
+
+
+def target_weights(prices: pd.DataFrame, risk_on: np.ndarray, winners: np.ndarray, risk_weight: float,
+                   defensive_assets: list, defensive_weights: list) -> tuple[np.ndarray, np.ndarray]:
+    """
+    逐 bar 目标权重：(列号, 权重) 两个 (bar x (1 + 防御资产数)) 矩阵，列号 -1 为空位
     
-    def __call__(self, target):
-        weights = {}
-        
-        if target.temp.get("risk_on", False):
-            selected = target.temp.get("selected", [])
-            if selected:
-                risk_w = self.risk_weight / len(selected)
-                for s in selected:
-                    weights[s] = risk_w
+    第 0 位为选中的风险资产（风险开启时），其余为防御资产；
+    选中标的与防御资产重叠时以防御权重为准
+    """
+    n = len(prices)
+    def_cols = prices.columns.get_indexer(defensive_assets)
+    def_w = np.where(def_cols >= 0, np.asarray(defensive_weights, dtype=np.float64), 0.0)
+    
+    order = np.full((n, 1 + len(def_cols)), -1, dtype=np.int64)
+    weights = np.zeros(order.shape)
+    order[:, 1:] = def_cols
+    weights[:, 1:] = np.where(risk_on[:, None], def_w * (1.0 - risk_weight), def_w)
+    
+    take = risk_on & (winners >= 0) & ~np.isin(winners, def_cols)
+    order[take, 0] = winners[take]
+    weights[take, 0] = risk_weight
+    return order, weights
+
+
+@njit(cache=True)
+def _rebalance_kernel(closes, rebalance, order, weights, initial_capital):
+    """
+    逐 bar 撮合内核：调仓日按目标权重整数股调仓，返回以 100 为起点的净值（含前补的一行）
+    
+    与 bt 的 Rebalance 口径一致：先清掉不在目标中的持仓，再以调仓前总资产为基数，
+    按 (目标权重 - 当前权重) 计算调整金额，买入向下取整、卖出多卖不足一股的部分；无交易费用
+    """
+    n, k = closes.shape
+    position = np.zeros(k)
+    current_w = np.zeros(k)
+    is_target = np.zeros(k, dtype=np.bool_)
+    nav = np.empty(n + 1)
+    nav[0] = 100.0
+    cash = initial_capital
+    last_value = initial_capital
+    
+    for i in range(n):
+        px = closes[i]
+        if rebalance[i]:
+            base = cash
+            for j in range(k):
+                base += position[j] * px[j]
+            for j in range(k):
+                current_w[j] = position[j] * px[j] / base if base != 0 else 0.0
             
-            def_total = 1.0 - self.risk_weight
-            for sym, w in zip(self.defensive_assets, self.defensive_weights):
-                weights[sym] = def_total * w
-        else:
-            for sym, w in zip(self.defensive_assets, self.defensive_weights):
-                weights[sym] = w
+            is_target[:] = False
+            for m in range(order.shape[1]):
+                if order[i, m] >= 0 and weights[i, m] != 0:
+                    is_target[order[i, m]] = True
+            for j in range(k):
+                if position[j] != 0 and not is_target[j]:
+                    cash += position[j] * px[j]
+                    position[j] = 0.0
+            
+            for m in range(order.shape[1]):
+                j = order[i, m]
+                if j < 0 or weights[i, m] == 0:
+                    continue
+                amount = (weights[i, m] - current_w[j]) * base
+                if abs(amount) < 1e-16:
+                    continue
+                if abs(amount + position[j] * px[j]) < 1e-16:
+                    q = -position[j]
+                elif position[j] > 0 or (position[j] == 0 and amount > 0):
+                    q = math.floor(amount / px[j])
+                else:
+                    q = math.ceil(amount / px[j])
+                position[j] += q
+                cash -= q * px[j]
         
-        # 转换为 Series 并设置
-        target.temp["weights"] = pd.Series(weights)
-        return True
+        value = cash
+        for j in range(k):
+            value += position[j] * px[j]
+        nav[i + 1] = nav[i] * (1 + (value - last_value) / last_value)
+        last_value = value
+    return nav
 
 
 def run_backtest(prices: pd.DataFrame, config: dict = None) -> dict:
-    """运行 BT 回测"""
+    """运行月度轮动回测"""
     if config is None:
         config = load_config()
     
@@ -143,56 +163,60 @@ def run_backtest(prices: pd.DataFrame, config: dict = None) -> dict:
     if prices.empty:
         return {"error": "无有效数据"}
     
-    # 构建策略
-    strategy = bt.Strategy(
-        "股债轮动",
-        [
-            bt.algos.RunMonthly(),
-            RiskSwitch(benchmark, cfg["risk_switch_ma"]),
-            SelectByMomentum(risk_codes, cfg["momentum_months"]),
-            WeighRiskDefensive(cfg["risk_weight_on"], def_codes, def_weights),
-            bt.algos.Rebalance(),
-        ]
+    # 信号整表一次算出，再逐 bar 撮合
+    risk_on = (
+        risk_switch_series(prices[benchmark], cfg["risk_switch_ma"])
+        if benchmark in prices.columns else np.zeros(len(prices), dtype=bool)
     )
+    winners = momentum_winners(prices, risk_codes, cfg["momentum_months"])
+    order, weights = target_weights(prices, risk_on, winners, cfg["risk_weight_on"], def_codes, def_weights)
     
-    # 运行回测
-    # 注意：bt 库的 commissions 参数对函数形式有严格要求
-    # 使用固定比例费率更稳定，ETF综合费率约 0.031%（不含印花税）
-    test = bt.Backtest(strategy, prices, initial_capital=config["paper"]["initial_capital"])
-    result = bt.run(test)
+    # 每月首个 bar 调仓（月度数据即每个 bar）
+    periods = prices.index.to_period("M")
+    rebalance = np.ones(len(prices), dtype=np.bool_)
+    rebalance[1:] = periods[1:] != periods[:-1]
     
-    # 提取结果
-    equity = result[strategy.name].prices
+    nav_arr = _rebalance_kernel(
+        prices.to_numpy(dtype=np.float64), rebalance, order, weights, float(config["paper"]["initial_capital"])
+    )
+    # 净值首行对应起始日前一天（沿用 bt 的约定，曲线从 100 起步）
+    equity_index = prices.index.insert(0, prices.index[0] - pd.DateOffset(days=1))
     
-    # 计算统计
-    total_ret = float((equity.iloc[-1] / equity.iloc[0] - 1) * 100)
-    years = len(equity) / 12
+    # 计算统计 (直接在 NumPy 数组上计算)
+    date_strs = equity_index.strftime("%Y-%m-%d").tolist()
+    total_ret = float((nav_arr[-1] / nav_arr[0] - 1) * 100)
+    years = len(nav_arr) / 12
     annual_ret = float(total_ret / years) if years > 0 else 0.0
     
     # 最大回撤
-    peak = equity.cummax()
-    dd = (peak - equity) / peak
-    max_dd = float(dd.max() * 100)
+    peak = np.maximum.accumulate(nav_arr)
+    max_dd = float(((peak - nav_arr) / peak).max() * 100)
     
     # 月度收益
-    monthly_ret = equity.pct_change().dropna()
-    sharpe = float(monthly_ret.mean() / monthly_ret.std() * np.sqrt(12)) if monthly_ret.std() > 0 else 0.0
+    monthly_ret = nav_arr[1:] / nav_arr[:-1] - 1
+    ret_std = monthly_ret.std(ddof=1) if len(monthly_ret) > 1 else 0.0
+    sharpe = float(monthly_ret.mean() / ret_std * np.sqrt(12)) if ret_std > 0 else 0.0
     
     return {
         "total_return": round(total_ret, 2),
         "annual_return": round(annual_ret, 2),
         "max_drawdown": round(max_dd, 2),
         "sharpe": round(sharpe, 2),
-        "nav": {str(k)[:10]: round(float(v), 2) for k, v in equity.to_dict().items()},
-        "monthly_returns": {str(k)[:10]: round(float(v) * 100, 2) for k, v in monthly_ret.to_dict().items()},
-        # 多曲线对比数据
-        "benchmarks": get_benchmark_curves(prices, benchmark, equity.index),
+        # 曲线以平行数组返回：整列一次性转换，响应中不再重复日期键
+        "nav_dates": date_strs,
+        "nav_values": np.round(nav_arr, 2).tolist(),
+        "monthly_dates": date_strs[1:],
+        "monthly_returns": np.round(monthly_ret * 100, 2).tolist(),
+        # 多曲线对比数据（与 nav_dates 逐项对齐）
+        "benchmarks": get_benchmark_curves(prices, benchmark, equity_index),
     }
 
 
 def get_benchmark_curves(prices: pd.DataFrame, benchmark_code: str, dates) -> dict:
     """
     获取大盘和基金的基准曲线（归一化为初始值100）
+    
+    每条曲线的 values 与 dates 逐项对齐，缺数据的日期为 None
     """
     result = {}
     
@@ -201,29 +225,31 @@ def get_benchmark_curves(prices: pd.DataFrame, benchmark_code: str, dates) -> di
     if len(available_dates) == 0:
         return result
     
-    # 大盘（沪深300）
-    if benchmark_code in prices.columns:
-        bench = prices[benchmark_code].reindex(available_dates).dropna()
-        if len(bench) > 0:
-            normed = (bench / bench.iloc[0] * 100).round(2)
-            result["benchmark"] = {
-                "name": "沪深300ETF",
-                "nav": {str(k)[:10]: float(v) for k, v in normed.to_dict().items()}
-            }
-    
-    # 添加其他主要 ETF 对比
+    # 大盘（沪深300）+ 其他主要 ETF 对比
     compare_codes = ["510500", "510880"]  # 中证500、红利
     names = {"510500": "中证500ETF", "510880": "上证红利ETF"}
-    
+    curves = {"benchmark": (benchmark_code, "沪深300ETF")}
     for code in compare_codes:
-        if code in prices.columns and code != benchmark_code:
-            ser = prices[code].reindex(available_dates).dropna()
-            if len(ser) > 0:
-                normed = (ser / ser.iloc[0] * 100).round(2)
-                result[code] = {
-                    "name": names.get(code, code),
-                    "nav": {str(k)[:10]: float(v) for k, v in normed.to_dict().items()}
-                }
+        if code != benchmark_code:
+            curves[code] = (code, names.get(code, code))
+    
+    codes = [code for code, _ in curves.values() if code in prices.columns]
+    if not codes:
+        return result
+    
+    # 一次性对齐并归一化所有曲线，再按曲线日期整表对齐
+    frame = prices.loc[available_dates, codes]
+    normed = (frame / frame.bfill().iloc[0] * 100).round(2).reindex(dates)
+    
+    for key, (code, name) in curves.items():
+        if code not in normed.columns:
+            continue
+        values = normed[code].to_numpy()
+        mask = ~np.isnan(values)
+        if mask.any():
+            result[key] = {
+                "name": name,
+                "values": np.where(mask, values, None).tolist(),
+            }
     
     return result
-
@@ -1,12 +1,40 @@
 """
-模拟交易账户模块 - 每用户独立账户
+模拟交易账户模块 - 每用户独立账户（存储于 SQLite）
 """
 import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 from typing import Optional
+import numpy as np
 import pandas as pd
 
+from auth import get_conn
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # 未安装 orjson 时使用标准库 json
+    orjson = None
+
+
+if orjson is not None:
+    def _dump_tx(tx: dict) -> str:
+        """交易记录序列化为紧凑 JSON 文本（存 TEXT 列，不能存成 BLOB）"""
+        return orjson.dumps(tx).decode()
+
+    _load_tx = orjson.loads
+else:
+    def _dump_tx(tx: dict) -> str:
+        """交易记录序列化为紧凑 JSON 文本"""
+        return json.dumps(tx, ensure_ascii=False, separators=(",", ":"))
+
+    _load_tx = json.loads
+
 DATA_DIR = Path(__file__).parent.parent / "data"
 ACCOUNTS_DIR = DATA_DIR / "accounts"
 ACCOUNTS_DIR.mkdir(exist_ok=True)
@@ -24,6 +52,10 @@ TRADE_FEES = {
 }
 
 
+# 除佣金外按金额比例收取的费率合计（经手费 + 证管费 + 过户费）
+FEE_RATE_EX_COMMISSION = TRADE_FEES["handling_fee"] + TRADE_FEES["regulation_fee"] + TRADE_FEES["transfer_fee"]
+
+
 def calculate_fees(amount: float, is_sell: bool = False) -> dict:
     """
     计算交易费用
@@ -36,113 +68,340 @@ def calculate_fees(amount: float, is_sell: bool = False) -> dict:
     Returns:
         dict: 各项费用明细和总费用
     """
-    # 佣金（有最低限制）
+    # 佣金（有最低限制）+ 其余按比例的费用
     commission = max(amount * TRADE_FEES["commission"], TRADE_FEES["commission_min"])
-    # 经手费
-    handling_fee = amount * TRADE_FEES["handling_fee"]
-    # 证管费
-    regulation_fee = amount * TRADE_FEES["regulation_fee"]
-    # 过户费
-    transfer_fee = amount * TRADE_FEES["transfer_fee"]
-    
-    total = commission + handling_fee + regulation_fee + transfer_fee
+    total = commission + amount * FEE_RATE_EX_COMMISSION
     
     return {
         "commission": round(commission, 2),
-        "handling_fee": round(handling_fee, 2),
-        "regulation_fee": round(regulation_fee, 2),
-        "transfer_fee": round(transfer_fee, 2),
+        "handling_fee": round(amount * TRADE_FEES["handling_fee"], 2),  # 经手费
+        "regulation_fee": round(amount * TRADE_FEES["regulation_fee"], 2),  # 证管费
+        "transfer_fee": round(amount * TRADE_FEES["transfer_fee"], 2),  # 过户费
         "total": round(total, 2),
         "rate": round(total / amount * 100, 4) if amount > 0 else 0,  # 实际费率%
     }
 
 
 def get_account_path(user_id: int) -> Path:
+    """旧版账户 JSON 文件路径（仅用于导入到数据库）"""
     return ACCOUNTS_DIR / f"user_{user_id}.json"
 
 
-def get_or_create_account(user_id: int) -> dict:
-    """获取或创建用户账户"""
+def get_transactions_path(user_id: int) -> Path:
+    """旧版交易记录 JSON Lines 路径（仅用于导入到数据库）"""
+    return ACCOUNTS_DIR / f"user_{user_id}.transactions.jsonl"
+
+
+def get_archive_path(user_id: int) -> Path:
+    """超出保留条数的历史交易记录归档（追加写的 JSON Lines）"""
+    return ACCOUNTS_DIR / f"user_{user_id}.tx.log"
+
+
+def get_pending_archive_path(user_id: int) -> Path:
+    """待归档记录：事务提交前写入，提交后追加到归档日志（首行为本批最后一条记录的 id）"""
+    return ACCOUNTS_DIR / f"user_{user_id}.tx.log.pending"
+
+
+# ==================== SQL 语句 ====================
+SQL_GET_ACCOUNT = "SELECT cash, initial_capital, created_at, last_updated FROM accounts WHERE user_id = ?"
+SQL_INSERT_ACCOUNT = "INSERT OR IGNORE INTO accounts (user_id, cash, initial_capital, created_at, last_updated) VALUES (?, ?, ?, ?, ?)"
+SQL_UPDATE_ACCOUNT = "UPDATE accounts SET cash = ?, last_updated = ? WHERE user_id = ?"
+SQL_GET_POSITIONS = "SELECT symbol, shares, avg_cost FROM positions WHERE user_id = ? ORDER BY rowid"
+SQL_DELETE_POSITIONS = "DELETE FROM positions WHERE user_id = ?"
+SQL_INSERT_POSITION = "INSERT INTO positions (user_id, symbol, shares, avg_cost) VALUES (?, ?, ?, ?)"
+SQL_UPSERT_POSITION = """
+    INSERT INTO positions (user_id, symbol, shares, avg_cost) VALUES (?, ?, ?, ?)
+    ON CONFLICT(user_id, symbol) DO UPDATE SET shares = excluded.shares, avg_cost = excluded.avg_cost
+"""
+SQL_DELETE_POSITION = "DELETE FROM positions WHERE user_id = ? AND symbol = ?"
+SQL_INSERT_TRANSACTION = "INSERT INTO transactions (user_id, time, data) VALUES (?, ?, ?)"
+SQL_ALL_TRANSACTIONS = "SELECT data FROM transactions WHERE user_id = ? ORDER BY id"
+SQL_LAST_TRANSACTIONS = "SELECT data FROM transactions WHERE user_id = ? ORDER BY id DESC LIMIT ?"
+SQL_UPSERT_NAV = """
+    INSERT INTO nav_history (user_id, date, value) VALUES (?, ?, ?)
+    ON CONFLICT(user_id, date) DO UPDATE SET value = excluded.value
+"""
+# 只保留最近 NAV_HISTORY_DAYS 条
+SQL_TRIM_NAV = """
+    DELETE FROM nav_history WHERE user_id = ? AND date < (
+        SELECT date FROM nav_history WHERE user_id = ? ORDER BY date DESC LIMIT 1 OFFSET ?
+    )
+"""
+# 分页查询：游标为上一页最后一条的 id / 日期，LIMIT -1 表示不限条数
+SQL_PAGE_TRANSACTIONS = """
+    SELECT id, data FROM transactions
+    WHERE user_id = ? AND (? IS NULL OR id < ?) ORDER BY id DESC LIMIT ?
+"""
+SQL_PAGE_NAV = """
+    SELECT date, value FROM nav_history
+    WHERE user_id = ? AND (? IS NULL OR date < ?) ORDER BY date DESC LIMIT ?
+"""
+# 最近 N 笔交易中晚于给定时间的成交时间（按时间正序）；ISO 时间字符串可直接按字典序比较
+SQL_RECENT_TRADE_TIMES = """
+    SELECT time FROM (
+        SELECT id, time FROM transactions WHERE user_id = ? ORDER BY id DESC LIMIT ?
+    ) WHERE time > ? ORDER BY id
+"""
+# 超出保留条数时，取最早一条需保留记录之前的行归档
+SQL_TX_ARCHIVE_CUTOFF = "SELECT id FROM transactions WHERE user_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?"
+SQL_TX_BEFORE = "SELECT data FROM transactions WHERE user_id = ? AND id <= ? ORDER BY id"
+SQL_DELETE_TX_BEFORE = "DELETE FROM transactions WHERE user_id = ? AND id <= ?"
+SQL_TX_EXISTS = "SELECT 1 FROM transactions WHERE user_id = ? AND id = ?"
+SQL_ALL_ACCOUNT_TOTALS = "SELECT user_id, cash, initial_capital FROM accounts"
+SQL_ALL_POSITIONS = "SELECT user_id, symbol, shares FROM positions ORDER BY rowid"
+
+NAV_HISTORY_DAYS = 365
+# 数据库中每用户保留的交易记录条数，更早的记录追加写入归档日志
+TRANSACTIONS_KEEP = 1000
+# 持仓缓存 {user_id: (last_updated, positions)}：每次写账户都会刷新 last_updated，
+# 读到的账户行时间戳未变（包括其他 worker 进程也未写过）时直接复用，省去持仓查询
+_positions_cache: dict = {}
+
+
+def load_transactions(user_id: int, limit: Optional[int] = None) -> list:
+    """读取库中保留的交易记录（按时间正序），指定 limit 时只读取并解析最后 limit 条"""
+    conn = get_conn()
+    if limit is None:
+        rows = conn.execute(SQL_ALL_TRANSACTIONS, (user_id,)).fetchall()
+    elif limit <= 0:
+        return []
+    else:
+        rows = conn.execute(SQL_LAST_TRANSACTIONS, (user_id, limit)).fetchall()[::-1]
+    return [_load_tx(row[0]) for row in rows]
+
+
+def recent_trade_times(user_id: int, since: str, limit: int = 10) -> list:
+    """最近 limit 笔交易中成交时间晚于 since（ISO 格式）的时间列表，按时间正序"""
+    return [row[0] for row in get_conn().execute(SQL_RECENT_TRADE_TIMES, (user_id, limit, since))]
+
+
+def _read_account_file(path: Path) -> dict:
+    """读取旧版账户文件"""
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _import_legacy_account(user_id: int) -> bool:
+    """
+    把旧版 JSON 账户（含净值历史与交易日志）导入数据库，成功后文件加 .migrated 后缀保留
+    
+    Returns:
+        bool: 是否存在旧账户文件
+    """
     path = get_account_path(user_id)
+    if not path.exists():
+        return False
+    account = _read_account_file(path)
+    tx_path = get_transactions_path(user_id)
+    if tx_path.exists():
+        transactions = [_load_tx(line) for line in tx_path.read_text(encoding="utf-8").splitlines() if line]
+    else:
+        transactions = account.get("transactions") or []
+    
+    conn = get_conn()
+    with _write_transaction(conn):
+        conn.execute(SQL_INSERT_ACCOUNT, (
+            user_id, account["cash"], account["initial_capital"],
+            account.get("created_at"), account.get("last_updated"),
+        ))
+        conn.executemany(SQL_INSERT_POSITION, [
+            (user_id, symbol, p["shares"], p["avg_cost"]) for symbol, p in account["positions"].items()
+        ])
+        conn.executemany(SQL_UPSERT_NAV, [
+            (user_id, r["date"], r["value"]) for r in account.get("nav_history", [])
+        ])
+        conn.executemany(SQL_INSERT_TRANSACTION, [
+            (user_id, tx.get("time", ""), _dump_tx(tx)) for tx in transactions
+        ])
+        # 导入可能并入调用方的交易事务：提交后才改名，事务回滚时旧文件保留，下次访问重新导入
+        _after_commit(lambda: _mark_migrated(path, tx_path))
+    return True
+
+
+def _mark_migrated(*paths: Path):
+    """旧版账户文件加 .migrated 后缀保留"""
+    for p in paths:
+        if p.exists():
+            p.rename(p.with_name(p.name + ".migrated"))
+
+
+# 每线程一个数据库连接，提交后回调也按线程记录
+_txn_local = threading.local()
+
+
+@contextmanager
+def _write_transaction(conn):
+    """
+    写事务：BEGIN IMMEDIATE 开始即取得写锁，正常结束提交、出错回滚；已在事务内时并入外层事务
     
-    if path.exists():
-        account = json.loads(path.read_text())
-        # 确保旧账户有 nav_history 字段
-        if "nav_history" not in account:
-            account["nav_history"] = []
-            save_account(account)
-        return account
+    交易在同一事务内读取账户、试算并写回，同一用户的并发交易依次执行，不会基于同一份旧状态互相覆盖
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    _txn_local.after_commit = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+    callbacks, _txn_local.after_commit = _txn_local.after_commit, []
+    for callback in callbacks:
+        callback()
+
+
+def _after_commit(callback):
+    """登记在当前写事务提交后执行的动作（回滚时丢弃）"""
+    getattr(_txn_local, "after_commit", []).append(callback)
+
+
+def get_or_create_account(user_id: int) -> dict:
+    """获取或创建用户账户（净值历史与交易记录另表存储，按需读取）"""
+    conn = get_conn()
+    row = conn.execute(SQL_GET_ACCOUNT, (user_id,)).fetchone()
+    if row is None:
+        if not _import_legacy_account(user_id):
+            # 创建新账户
+            now = datetime.now().isoformat()
+            with _write_transaction(conn):
+                conn.execute(SQL_INSERT_ACCOUNT, (user_id, INITIAL_CAPITAL, INITIAL_CAPITAL, now, now))
+        row = conn.execute(SQL_GET_ACCOUNT, (user_id,)).fetchone()
+    
+    cached = _positions_cache.get(user_id)
+    if cached is not None and cached[0] == row["last_updated"]:
+        positions = cached[1]
+    else:
+        positions = {
+            symbol: {"shares": shares, "avg_cost": avg_cost}
+            for symbol, shares, avg_cost in conn.execute(SQL_GET_POSITIONS, (user_id,))
+        }
+        _positions_cache[user_id] = (row["last_updated"], positions)
     
-    # 创建新账户
-    account = {
+    return {
         "user_id": user_id,
-        "cash": INITIAL_CAPITAL,
-        "initial_capital": INITIAL_CAPITAL,
-        "positions": {},  # {symbol: {"shares": int, "avg_cost": float}}
-        "transactions": [],  # 交易记录
-        "nav_history": [],  # 净值历史 [{"date": str, "value": float}]
-        "created_at": datetime.now().isoformat(),
-        "last_updated": datetime.now().isoformat(),
+        "cash": row["cash"],
+        "initial_capital": row["initial_capital"],
+        # {symbol: {"shares": int, "avg_cost": float}}，按建仓顺序；调用方会原地修改，返回副本
+        "positions": {symbol: dict(p) for symbol, p in positions.items()},
+        "created_at": row["created_at"],
+        "last_updated": row["last_updated"],
     }
-    path.write_text(json.dumps(account, ensure_ascii=False, indent=2))
-    return account
 
 
-def save_account(account: dict):
-    """保存账户"""
+def _write_account(conn, account: dict, symbols: Optional[set] = None):
+    """
+    在调用方事务内写入现金与持仓
+    
+    Args:
+        symbols: 只同步这些标的的持仓行（仍持有则更新/插入，已清仓则删除）；默认整体重写
+    """
     account["last_updated"] = datetime.now().isoformat()
-    path = get_account_path(account["user_id"])
-    path.write_text(json.dumps(account, ensure_ascii=False, indent=2))
+    user_id = account["user_id"]
+    positions = account["positions"]
+    conn.execute(SQL_UPDATE_ACCOUNT, (account["cash"], account["last_updated"], user_id))
+    if symbols is None:
+        conn.execute(SQL_DELETE_POSITIONS, (user_id,))
+        conn.executemany(SQL_INSERT_POSITION, [
+            (user_id, symbol, p["shares"], p["avg_cost"]) for symbol, p in positions.items()
+        ])
+        return
+    # 新建仓的标的插入在末尾，与内存中字典的顺序一致
+    conn.executemany(SQL_UPSERT_POSITION, [
+        (user_id, symbol, positions[symbol]["shares"], positions[symbol]["avg_cost"])
+        for symbol in positions if symbol in symbols
+    ])
+    conn.executemany(SQL_DELETE_POSITION, [(user_id, symbol) for symbol in symbols if symbol not in positions])
+
+
+def save_account(account: dict):
+    """保存账户（现金与持仓在同一事务中写入）"""
+    with _write_transaction(get_conn()) as conn:
+        _write_account(conn, account)
+
+
+# 最新价格缓存：行情文件或配置变化后失效；PRICES_TTL 秒内直接复用，不再扫描目录和 stat 文件
+PRICES_TTL = 15
+_prices_cache = None
+_prices_cache_key = None
+_prices_checked_at = 0.0
 
 
 def get_current_prices() -> dict:
     """获取当前价格（从最新数据）"""
-    from data import load_prices_daily, get_asset_info
-    
-    prices = load_prices_daily()
-    if prices.empty:
+    global _prices_cache, _prices_cache_key, _prices_checked_at
+    now = time.monotonic()
+    if _prices_cache is not None and now - _prices_checked_at < PRICES_TTL:
+        return _prices_cache
+    
+    from data import load_latest_closes, get_asset_info, price_files, CONFIG_PATH
+    
+    paths, mtimes = price_files()
+    key = (paths, mtimes, CONFIG_PATH.stat().st_mtime_ns)
+    if _prices_cache is not None and key == _prices_cache_key:
+        _prices_checked_at = now
+        return _prices_cache
+    
+    # 只需最新一天的价格，按文件尾部读取，不加载整段历史
+    latest = load_latest_closes()
+    if not latest:
         return {}
     
-    latest = prices.iloc[-1]
     asset_info = get_asset_info()
     
     result = {}
-    for code in latest.index:
-        price = latest[code]
-        if pd.notna(price):
-            info = asset_info.get(code, {})
-            result[code] = {
-                "price": float(price),
-                "name": info.get("name", code),
-            }
+    for code, price in latest.items():
+        info = asset_info.get(code, {})
+        result[code] = {
+            "price": float(price),
+            "name": info.get("name", code),
+        }
+    
+    _prices_cache, _prices_cache_key, _prices_checked_at = result, key, now
     return result
 
 
+def _position_details(positions: dict, prices: dict) -> tuple[list, float]:
+    """持仓明细与持仓总市值（只计有行情的标的）"""
+    symbols = [s for s in positions if s in prices]
+    if not symbols:
+        # 空仓（新账户或已清仓）无需构造数组
+        return [], 0.0
+    
+    # 持仓按列展开为数组，市值/成本/盈亏整列计算后再转回字典
+    pos = [positions[s] for s in symbols]
+    shares = np.array([p["shares"] for p in pos], dtype=np.float64)
+    avg_cost = np.array([p["avg_cost"] for p in pos], dtype=np.float64)
+    current_price = np.array([prices[s]["price"] for s in symbols], dtype=np.float64)
+    value = shares * current_price
+    cost = shares * avg_cost
+    pnl = value - cost
+    pnl_pct = np.divide(pnl, cost, out=np.zeros_like(pnl), where=cost > 0) * 100
+    
+    positions_detail = [
+        {
+            "symbol": symbol,
+            "name": prices[symbol].get("name", symbol),
+            "shares": p["shares"],
+            "avg_cost": round(p["avg_cost"], 3),
+            "current_price": round(px, 3),
+            "value": round(v, 2),
+            "pnl": round(g, 2),
+            "pnl_pct": round(g_pct, 2),
+        }
+        for symbol, p, px, v, g, g_pct in zip(
+            symbols, pos, current_price.tolist(), value.tolist(), pnl.tolist(), pnl_pct.tolist()
+        )
+    ]
+    return positions_detail, sum(value.tolist(), 0.0)
+
+
 def calculate_portfolio_value(account: dict, prices: dict) -> dict:
     """计算投资组合价值"""
     cash = account["cash"]
-    positions_value = 0.0
-    positions_detail = []
-    
-    for symbol, pos in account["positions"].items():
-        if symbol in prices:
-            current_price = prices[symbol]["price"]
-            value = pos["shares"] * current_price
-            cost = pos["shares"] * pos["avg_cost"]
-            pnl = value - cost
-            pnl_pct = (pnl / cost * 100) if cost > 0 else 0
-            
-            positions_detail.append({
-                "symbol": symbol,
-                "name": prices[symbol].get("name", symbol),
-                "shares": pos["shares"],
-                "avg_cost": round(pos["avg_cost"], 3),
-                "current_price": round(current_price, 3),
-                "value": round(value, 2),
-                "pnl": round(pnl, 2),
-                "pnl_pct": round(pnl_pct, 2),
-            })
-            positions_value += value
+    positions_detail, positions_value = _position_details(account["positions"], prices)
     
     total_value = cash + positions_value
     total_pnl = total_value - account["initial_capital"]
@@ -159,22 +418,68 @@ def calculate_portfolio_value(account: dict, prices: dict) -> dict:
     }
 
 
-def buy(user_id: int, symbol: str, amount: float) -> tuple[bool, str]:
+def compute_total_value(account: dict, prices: dict) -> float:
+    """总资产（现金 + 有行情持仓的市值），与 calculate_portfolio_value 的 total_value 口径一致，不构造持仓明细"""
+    positions_value = sum(
+        (float(p["shares"]) * prices[s]["price"] for s, p in account["positions"].items() if s in prices), 0.0
+    )
+    return round(account["cash"] + positions_value, 2)
+
+
+def portfolio_totals(user_ids: list, prices: dict) -> list:
     """
-    买入（含交易费用）
-    amount: 买入金额
+    批量计算多个账户的 (总资产, 总盈亏, 总盈亏%)，口径与 calculate_portfolio_value 一致
+    
+    只读数据库，不为没有账户的用户建档（按初始资金计）。
+    所有持仓展开为 (账户序号, 股数, 现价) 三列，按账户一次 bincount 汇总市值
     """
-    account = get_or_create_account(user_id)
-    prices = get_current_prices()
+    n = len(user_ids)
+    index = {user_id: k for k, user_id in enumerate(user_ids)}
+    cash = np.full(n, INITIAL_CAPITAL)
+    initial = np.full(n, INITIAL_CAPITAL)
+    conn = get_conn()
+    for user_id, c, init in conn.execute(SQL_ALL_ACCOUNT_TOTALS):
+        k = index.get(user_id)
+        if k is not None:
+            cash[k] = c
+            initial[k] = init
+    owner, shares, price = [], [], []
+    for user_id, symbol, s in conn.execute(SQL_ALL_POSITIONS):
+        k = index.get(user_id)
+        if k is not None and symbol in prices:
+            owner.append(k)
+            shares.append(s)
+            price.append(prices[symbol]["price"])
+    
+    positions_value = np.bincount(
+        np.asarray(owner, dtype=np.int64),
+        weights=np.asarray(shares, dtype=np.float64) * np.asarray(price, dtype=np.float64),
+        minlength=n,
+    )
+    total_value = cash + positions_value
+    total_pnl = total_value - initial
+    total_pnl_pct = total_pnl / initial * 100
+    return [
+        (round(v, 2), round(g, 2), round(g_pct, 2))
+        for v, g, g_pct in zip(total_value.tolist(), total_pnl.tolist(), total_pnl_pct.tolist())
+    ]
+
+
+def _apply_buy(account: dict, prices: dict, symbol: str, amount: float) -> tuple[bool, str, Optional[dict]]:
+    """
+    在内存中对账户执行买入（含交易费用），不写库
     
+    Returns:
+        tuple: (是否成功, 提示信息, 交易记录)
+    """
     if symbol not in prices:
-        return False, f"未找到标的 {symbol}"
+        return False, f"未找到标的 {symbol}", None
     
     price = prices[symbol]["price"]
     shares = int(amount / price / 100) * 100  # 按100股整数买入
     
     if shares == 0:
-        return False, "金额不足买入100股"
+        return False, "金额不足买入100股", None
     
     cost = shares * price
     # 计算交易费用
@@ -182,7 +487,7 @@ def buy(user_id: int, symbol: str, amount: float) -> tuple[bool, str]:
     total_cost = cost + fees["total"]
     
     if total_cost > account["cash"]:
-        return False, f"现金不足，需要 {total_cost:.2f}（含费用 {fees['total']:.2f}），可用 {account['cash']:.2f}"
+        return False, f"现金不足，需要 {total_cost:.2f}（含费用 {fees['total']:.2f}），可用 {account['cash']:.2f}", None
     
     # 更新持仓（成本包含费用）
     if symbol in account["positions"]:
@@ -198,7 +503,7 @@ def buy(user_id: int, symbol: str, amount: float) -> tuple[bool, str]:
     account["cash"] -= total_cost
     
     # 记录交易（含费用明细）
-    account["transactions"].append({
+    tx = {
         "type": "buy",
         "symbol": symbol,
         "shares": shares,
@@ -207,29 +512,26 @@ def buy(user_id: int, symbol: str, amount: float) -> tuple[bool, str]:
         "fees": fees,
         "total_cost": total_cost,
         "time": datetime.now().isoformat(),
-    })
-    
-    # 记录净值历史
-    _record_nav_history(account, prices)
-    
-    save_account(account)
-    return True, f"买入 {symbol} {shares}股，成交价 {price:.3f}，金额 {cost:.2f}，费用 {fees['total']:.2f}（{fees['rate']:.3f}%）"
+    }
+    return True, f"买入 {symbol} {shares}股，成交价 {price:.3f}，金额 {cost:.2f}，费用 {fees['total']:.2f}（{fees['rate']:.3f}%）", tx
 
 
-def sell(user_id: int, symbol: str, shares: int) -> tuple[bool, str]:
-    """卖出（含交易费用）"""
-    account = get_or_create_account(user_id)
-    prices = get_current_prices()
+def _apply_sell(account: dict, prices: dict, symbol: str, shares: int) -> tuple[bool, str, Optional[dict]]:
+    """
+    在内存中对账户执行卖出（含交易费用），不写库
     
+    Returns:
+        tuple: (是否成功, 提示信息, 交易记录)
+    """
     if symbol not in prices:
-        return False, f"未找到标的 {symbol}"
+        return False, f"未找到标的 {symbol}", None
     
     if symbol not in account["positions"]:
-        return False, f"未持有 {symbol}"
+        return False, f"未持有 {symbol}", None
     
     pos = account["positions"][symbol]
     if shares > pos["shares"]:
-        return False, f"持有 {pos['shares']}股，无法卖出 {shares}股"
+        return False, f"持有 {pos['shares']}股，无法卖出 {shares}股", None
     
     price = prices[symbol]["price"]
     amount = shares * price
@@ -247,7 +549,7 @@ def sell(user_id: int, symbol: str, shares: int) -> tuple[bool, str]:
     account["cash"] += net_amount
     
     # 记录交易（含费用明细）
-    account["transactions"].append({
+    tx = {
         "type": "sell",
         "symbol": symbol,
         "shares": shares,
@@ -256,56 +558,189 @@ def sell(user_id: int, symbol: str, shares: int) -> tuple[bool, str]:
         "fees": fees,
         "net_amount": net_amount,
         "time": datetime.now().isoformat(),
-    })
+    }
+    return True, f"卖出 {symbol} {shares}股，成交价 {price:.3f}，金额 {amount:.2f}，费用 {fees['total']:.2f}，实得 {net_amount:.2f}", tx
+
+
+def _commit_trades(account: dict, txs: list, prices: Optional[dict] = None):
+    """
+    在一个事务中写入账户、持仓与交易记录，传入 prices 时同时写入当日净值
     
-    # 记录净值历史
-    _record_nav_history(account, prices)
+    任一步失败整体回滚，不会出现现金已扣而交易记录缺失的情况；
+    在调用方读取账户的事务内调用时并入该事务
+    """
+    user_id = account["user_id"]
+    with _write_transaction(get_conn()) as conn:
+        # 只有成交涉及的标的需要同步持仓行
+        _write_account(conn, account, {tx["symbol"] for tx in txs})
+        conn.executemany(SQL_INSERT_TRANSACTION, [
+            (user_id, tx["time"], _dump_tx(tx)) for tx in txs
+        ])
+        _archive_transactions(conn, user_id)
+        if prices is not None:
+            _write_nav(conn, user_id, compute_total_value(account, prices))
+
+
+def _archive_transactions(conn, user_id: int):
+    """
+    在调用方事务内把超出 TRANSACTIONS_KEEP 的最早记录移出数据库
     
-    save_account(account)
-    return True, f"卖出 {symbol} {shares}股，成交价 {price:.3f}，金额 {amount:.2f}，费用 {fees['total']:.2f}，实得 {net_amount:.2f}"
+    记录先写入待归档文件，事务提交后才追加到归档日志，回滚时不会在归档中留下仍在库中的记录；
+    写文件失败时事务回滚，记录仍留在库中
+    """
+    _settle_pending_archive(conn, user_id)
+    row = conn.execute(SQL_TX_ARCHIVE_CUTOFF, (user_id, TRANSACTIONS_KEEP)).fetchone()
+    if row is None:
+        return
+    cutoff = row[0]
+    rows = conn.execute(SQL_TX_BEFORE, (user_id, cutoff)).fetchall()
+    with get_pending_archive_path(user_id).open("w", encoding="utf-8") as f:
+        f.write(f"{cutoff}\n")
+        f.writelines(data + "\n" for (data,) in rows)
+    conn.execute(SQL_DELETE_TX_BEFORE, (user_id, cutoff))
+    _after_commit(lambda: _settle_archive_now(user_id))
 
 
-def reset_account(user_id: int) -> dict:
-    """重置账户"""
-    path = get_account_path(user_id)
-    if path.exists():
-        path.unlink()
-    return get_or_create_account(user_id)
+def _settle_archive_now(user_id: int):
+    """在独立写事务中处理待归档文件，多个 worker 不会重复追加同一批记录"""
+    with _write_transaction(get_conn()) as conn:
+        _settle_pending_archive(conn, user_id)
 
 
-def get_transactions(user_id: int, limit: int = 20) -> list:
-    """获取交易记录"""
-    account = get_or_create_account(user_id)
-    return account["transactions"][-limit:][::-1]
+def _settle_pending_archive(conn, user_id: int):
+    """
+    处理待归档文件：截止 id 已不在库中说明删除已提交，追加到归档日志；仍在库中说明事务未提交，直接丢弃
+    
+    提交后追加失败或进程中断时文件保留，下次归档前再处理
+    """
+    pending = get_pending_archive_path(user_id)
+    if not pending.exists():
+        return
+    try:
+        cutoff, _, lines = pending.read_text(encoding="utf-8").partition("\n")
+        if conn.execute(SQL_TX_EXISTS, (user_id, int(cutoff))).fetchone() is None:
+            with get_archive_path(user_id).open("a", encoding="utf-8") as f:
+                f.write(lines)
+        pending.unlink()
+    except OSError as e:
+        logger.error("交易记录归档失败 user=%s: %s", user_id, e)
 
 
-def _record_nav_history(account: dict, prices: dict):
-    """记录净值历史（每日只记录一次）"""
-    today = datetime.now().strftime("%Y-%m-%d")
+def buy(user_id: int, symbol: str, amount: float, record_nav: bool = True) -> tuple[bool, str]:
+    """
+    买入（含交易费用）
+    amount: 买入金额
+    record_nav: 是否同时记录净值
+    """
+    prices = get_current_prices()
+    with _write_transaction(get_conn()):
+        account = get_or_create_account(user_id)
+        success, msg, tx = _apply_buy(account, prices, symbol, amount)
+        if success:
+            _commit_trades(account, [tx], prices if record_nav else None)
+    return success, msg
+
+
+def sell(user_id: int, symbol: str, shares: int, record_nav: bool = True) -> tuple[bool, str]:
+    """卖出（含交易费用）"""
+    prices = get_current_prices()
+    with _write_transaction(get_conn()):
+        account = get_or_create_account(user_id)
+        success, msg, tx = _apply_sell(account, prices, symbol, shares)
+        if success:
+            _commit_trades(account, [tx], prices if record_nav else None)
+    return success, msg
+
+
+def execute_batch(user_id: int, actions: list, strict: bool = False) -> list:
+    """
+    批量交易：账户与价格只读取一次，逐笔在内存中成交后统一写入并记录一次净值；
+    读取账户到写回在同一写事务内完成
+    
+    Args:
+        actions: [(action, symbol, amount_or_shares)]，按顺序执行，action 为 buy / sell
+        strict: 任一笔失败则整批不写库（内存中的试算结果直接丢弃）
     
-    # 计算当前净值
-    portfolio = calculate_portfolio_value(account, prices)
-    total_value = portfolio["total_value"]
+    Returns:
+        list: 每笔的 {"symbol", "action", "success", "message"}
+    """
+    prices = get_current_prices()
+    results, txs = [], []
+    with _write_transaction(get_conn()):
+        account = get_or_create_account(user_id)
+        for action, symbol, value in actions:
+            apply = _apply_sell if action == "sell" else _apply_buy
+            try:
+                success, msg, tx = apply(account, prices, symbol, value)
+            except Exception as e:
+                success, msg, tx = False, str(e), None
+            if success:
+                txs.append(tx)
+            results.append({"symbol": symbol, "action": action, "success": success, "message": msg})
+        
+        if txs and not (strict and len(txs) < len(results)):
+            _commit_trades(account, txs, prices)
+    return results
+
+
+def reset_account(user_id: int) -> dict:
+    """重置账户（清空持仓、净值历史与交易记录）"""
+    conn = get_conn()
+    with _write_transaction(conn):
+        for table in ("accounts", "positions", "nav_history", "transactions"):
+            conn.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+    _positions_cache.pop(user_id, None)
+    get_archive_path(user_id).unlink(missing_ok=True)
+    get_pending_archive_path(user_id).unlink(missing_ok=True)
+    return get_or_create_account(user_id)
+
+
+def get_transactions(user_id: int, limit: int = 20, cursor: Optional[int] = None) -> list:
+    """
+    获取交易记录（按时间倒序分页）
     
-    # 检查今天是否已记录
-    if account["nav_history"]:
-        last_record = account["nav_history"][-1]
-        if last_record["date"] == today:
-            # 更新今天的记录
-            account["nav_history"][-1]["value"] = total_value
-            return
+    Args:
+        limit: 每页条数
+        cursor: 上一页最后一条记录的 id，只返回更早的记录
     
-    # 添加新记录
-    account["nav_history"].append({
-        "date": today,
-        "value": total_value
-    })
+    Returns:
+        list: 交易记录，每条附带 id 供翻页
+    """
+    rows = get_conn().execute(SQL_PAGE_TRANSACTIONS, (user_id, cursor, cursor, limit))
+    return [{"id": tx_id, **_load_tx(data)} for tx_id, data in rows]
+
+
+def _write_nav(conn, user_id: int, total_value: float):
+    """
+    在调用方事务内写入当日净值（当天重复记录时覆盖），并只保留最近 NAV_HISTORY_DAYS 条
     
-    # 只保留最近 365 天
-    account["nav_history"] = account["nav_history"][-365:]
+    随交易在同一事务内直接落库，不在进程内缓冲：多 worker 部署时各进程读到的都是同一份净值，
+    重置账户后也不会有旧值被写回
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    conn.execute(SQL_UPSERT_NAV, (user_id, today, total_value))
+    conn.execute(SQL_TRIM_NAV, (user_id, user_id, NAV_HISTORY_DAYS - 1))
 
 
-def get_nav_history(user_id: int) -> list:
-    """获取用户净值历史"""
+def _record_nav_history(account: dict, prices: dict):
+    """记录净值历史（每日只记录一次，当天重复记录时覆盖）"""
+    with _write_transaction(get_conn()) as conn:
+        _write_nav(conn, account["user_id"], compute_total_value(account, prices))
+
+
+def record_nav(user_id: int):
+    """按当前价格记录一次净值（批量交易结束后只估值一次）"""
     account = get_or_create_account(user_id)
-    return account.get("nav_history", [])
+    _record_nav_history(account, get_current_prices())
+
+
+def get_nav_history(user_id: int, limit: Optional[int] = None, cursor: Optional[str] = None) -> list:
+    """
+    获取用户净值历史（按日期正序）
+    
+    Args:
+        limit: 只取最近 limit 条，默认全部
+        cursor: 只返回该日期（YYYY-MM-DD）之前的记录
+    """
+    rows = get_conn().execute(SQL_PAGE_NAV, (user_id, cursor, cursor, -1 if limit is None else limit)).fetchall()
+    return [{"date": date, "value": value} for date, value in reversed(rows)]
@@ -0,0 +1,36 @@
+"""
+测试公共夹具：后端模块按顶层名互相导入，测试时把 src 加入搜索路径
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+SRC_DIR = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(SRC_DIR))
+# 行情模块导入时会在仓库根目录下创建 data 目录，交易模块依赖它已存在
+(SRC_DIR.parent / "data").mkdir(exist_ok=True)
+
+import auth  # noqa: E402
+import trading  # noqa: E402
+
+PRICES = {
+    "510300": {"price": 3.912, "name": "沪深300ETF"},
+    "511010": {"price": 131.27, "name": "国债ETF"},
+}
+
+
+@pytest.fixture
+def trading_db(tmp_path, monkeypatch):
+    """把用户库与账户目录指向临时目录，价格固定为 PRICES"""
+    monkeypatch.setattr(auth, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(auth, "DB_PATH", tmp_path / "users.db")
+    monkeypatch.setattr(trading, "ACCOUNTS_DIR", tmp_path / "accounts")
+    monkeypatch.setattr(trading, "get_current_prices", lambda: PRICES)
+    (tmp_path / "accounts").mkdir()
+    auth._local.conn = None
+    trading._positions_cache.clear()
+    auth.init_db()
+    yield tmp_path
+    auth._local.conn.close()
+    auth._local.conn = None
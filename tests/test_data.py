@@ -0,0 +1,68 @@
+"""
+行情缓存读写测试
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import data
+
+
+def _daily_frame(close: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame({
+        "date": pd.bdate_range("2015-01-05", periods=len(close)),
+        "open": close, "high": close, "low": close, "close": close,
+        "volume": np.arange(len(close), dtype=np.int64),
+    })
+
+
+def _round_trip(df: pd.DataFrame, path) -> tuple[pa.Table, pd.DataFrame]:
+    data._write_parquet(df, path)
+    return pq.read_table(path), data._restore_prices(pq.read_table(path)).to_pandas()
+
+
+@pytest.mark.parametrize("close", [
+    # 最小价位 0.001 的 ETF 价格，覆盖 float32 可精确还原的整个范围
+    np.round(np.random.default_rng(0).uniform(0.001, data.PRICE_FLOAT32_LIMIT - 0.001, 2000), 3),
+    np.array([0.001, 1.0, 3.912, 131.27, 8191.999]),
+])
+def test_tick_prices_round_trip_exactly_as_float32(tmp_path, close):
+    stored, restored = _round_trip(_daily_frame(close), tmp_path / "510300.parquet")
+    assert stored.schema.field("close").type == pa.float32()
+    np.testing.assert_array_equal(restored["close"].to_numpy(), close)
+
+
+@pytest.mark.parametrize("close", [
+    np.array([3.912, 8192.0, 12345.678]),  # 超出 float32 精确范围的点位
+    np.array([1.23456789, 3.912, 4.5]),  # 不在 0.001 价位上的复权价
+])
+def test_prices_beyond_float32_precision_are_kept_as_float64(tmp_path, close):
+    stored, restored = _round_trip(_daily_frame(close), tmp_path / "000300.parquet")
+    assert stored.schema.field("close").type == pa.float64()
+    np.testing.assert_array_equal(restored["close"].to_numpy(), close)
+
+
+
+def test_concurrent_writes_to_same_path_do_not_share_temp_file(tmp_path, monkeypatch, caplog):
+    path = tmp_path / "510300.parquet"
+    barrier = threading.Barrier(2, timeout=5)
+    to_parquet = pd.DataFrame.to_parquet
+
+    def to_parquet_then_wait(self, *args, **kwargs):
+        to_parquet(self, *args, **kwargs)
+        barrier.wait()  # 两个写入方都写完临时文件后再各自替换
+
+    monkeypatch.setattr(pd.DataFrame, "to_parquet", to_parquet_then_wait)
+    frames = [_daily_frame(np.full(500, 1.0 + i)) for i in range(2)]
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        list(pool.map(lambda df: data._write_parquet(df, path), frames))
+
+    assert not [r for r in caplog.records if r.levelname == "ERROR"]
+    restored = data._restore_prices(pq.read_table(path)).to_pandas()
+    assert restored["close"].nunique() == 1 and len(restored) == 500
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
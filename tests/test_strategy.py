@@ -0,0 +1,31 @@
+"""
+策略回测测试
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import strategy
+
+# 由移除 bt 之前的逐 bar bt 实现（SelectByMomentum 等 Algo）在同一份月频价格上记录的结果，
+# 覆盖均线周期不大于动量周期的情形（含补空行的首个动量 bar）
+FIXTURE = json.loads((Path(__file__).parent / "fixtures" / "bt_backtest.json").read_text(encoding="utf-8"))
+
+
+def _fixture_prices() -> pd.DataFrame:
+    index = pd.DatetimeIndex(FIXTURE["dates"])
+    return pd.DataFrame({code: np.array(v, dtype=np.float64) for code, v in FIXTURE["prices"].items()}, index=index)
+
+
+@pytest.mark.parametrize("case", FIXTURE["cases"], ids=lambda c: "mom{momentum_months}-ma{risk_switch_ma}-w{risk_weight_on}".format(**c["strategy"]))
+def test_run_backtest_matches_recorded_bt_output(case):
+    config = {**FIXTURE["config"], "strategy": case["strategy"]}
+    result = strategy.run_backtest(_fixture_prices(), config)
+    expected = case["expected"]
+    for key in ("total_return", "annual_return", "max_drawdown", "sharpe"):
+        assert result[key] == expected[key], key
+    assert result["nav_dates"] == expected["nav_dates"]
+    assert result["nav_values"] == expected["nav_values"]
@@ -0,0 +1,107 @@
+"""
+模拟交易账户测试
+"""
+import json
+import threading
+import time
+
+import pytest
+
+import trading
+
+
+def test_concurrent_trades_do_not_lose_updates(trading_db, monkeypatch):
+    """同一用户两笔交易同时执行时，后一笔基于前一笔写回后的账户成交"""
+    apply_buy = trading._apply_buy
+
+    def slow_apply_buy(*args):
+        # 拉长读取账户与写回之间的窗口，没有写锁时两笔交易都会读到同一份初始现金
+        time.sleep(0.2)
+        return apply_buy(*args)
+
+    monkeypatch.setattr(trading, "_apply_buy", slow_apply_buy)
+    trading.get_or_create_account(1)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda s=symbol, a=amount: results.append(trading.buy(1, s, a)))
+        for symbol, amount in (("510300", 20000), ("511010", 30000))
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert [ok for ok, _ in results] == [True, True]
+    account = trading.get_or_create_account(1)
+    assert set(account["positions"]) == {"510300", "511010"}
+    txs = trading.load_transactions(1)
+    spent = sum(tx["amount"] + tx["fees"]["total"] for tx in txs)
+    assert len(txs) == 2
+    assert account["cash"] == pytest.approx(trading.INITIAL_CAPITAL - spent)
+
+
+def test_trade_writes_nav_immediately_and_reset_clears_it(trading_db):
+    """净值随交易落库，其他进程立即可见；重置后不会被写回"""
+    assert trading.buy(1, "510300", 20000)[0]
+    history = trading.get_nav_history(1)
+    assert len(history) == 1
+    assert history[0]["value"] == pytest.approx(trading.compute_total_value(
+        trading.get_or_create_account(1), trading.get_current_prices()))
+
+    trading.reset_account(1)
+    assert trading.get_nav_history(1) == []
+
+
+def test_archive_is_written_only_after_commit(trading_db, monkeypatch):
+    """归档在删除提交后才追加；事务回滚时归档中不会出现仍留在库中的记录"""
+    monkeypatch.setattr(trading, "TRANSACTIONS_KEEP", 2)
+    for _ in range(3):
+        assert trading.buy(1, "510300", 1000)[0]
+    archive = trading.get_archive_path(1)
+    assert len(archive.read_text(encoding="utf-8").splitlines()) == 1
+    assert not trading.get_pending_archive_path(1).exists()
+
+    def fail(*args):
+        raise RuntimeError("boom")
+
+    with monkeypatch.context() as m:
+        m.setattr(trading, "_write_nav", fail)
+        with pytest.raises(RuntimeError):
+            trading.buy(1, "510300", 1000)
+    assert len(archive.read_text(encoding="utf-8").splitlines()) == 1
+    assert len(trading.load_transactions(1)) == 2
+
+    assert trading.buy(1, "510300", 1000)[0]
+    archived = archive.read_text(encoding="utf-8").splitlines()
+    kept = trading.load_transactions(1)
+    assert len(archived) == 2 and len(kept) == 2
+    assert not {tx["time"] for tx in kept} & {trading._load_tx(line)["time"] for line in archived}
+
+
+def test_failed_trade_right_after_legacy_import_keeps_legacy_files(trading_db, monkeypatch):
+    """导入并入交易事务，交易失败回滚时旧账户文件不改名，下次访问重新导入"""
+    legacy = {
+        "cash": 123456.0, "initial_capital": 100000.0,
+        "positions": {"510300": {"shares": 1000, "avg_cost": 3.5}},
+        "created_at": "2024-01-02T09:30:00", "last_updated": "2024-01-02T09:30:00",
+        "nav_history": [], "transactions": [],
+    }
+    path = trading.get_account_path(7)
+    path.write_text(json.dumps(legacy), encoding="utf-8")
+
+    def fail(*args):
+        raise RuntimeError("boom")
+
+    with monkeypatch.context() as m:
+        m.setattr(trading, "_apply_buy", fail)
+        with pytest.raises(RuntimeError):
+            trading.buy(7, "510300", 1000)
+    assert path.exists()
+    assert not path.with_name(path.name + ".migrated").exists()
+
+    account = trading.get_or_create_account(7)
+    assert account["cash"] == 123456.0
+    assert account["positions"] == {"510300": {"shares": 1000, "avg_cost": 3.5}}
+    assert not path.exists()
+    assert path.with_name(path.name + ".migrated").exists()